@@ -8,9 +8,8 @@ import test
 import pdf_service
 import style
 
-# 1. Inicjalizacja bazy danych i danych startowych (Admin, Grupy)
-db.init_db()
-manager.init_system_data()
+# 1. Inicjalizacja bazy danych i danych startowych (Admin, Grupy) - raz na proces
+manager.bootstrap()
 
 # 2. Konfiguracja strony (optymalizacja pod mobile)
 st.set_page_config(
@@ -27,6 +26,12 @@ if 'logged_in' not in st.session_state:
 if 'user' not in st.session_state:
     st.session_state.user = None
 
+def client_ip():
+    """Adres IP klienta (za Nginx Proxy Managerem - adres dopisany przez proxy do X-Forwarded-For)."""
+    context = getattr(st, "context", None)
+    headers = getattr(context, "headers", None) or {}
+    return manager.client_address(headers.get("X-Forwarded-For"), getattr(context, "ip_address", None))
+
 def login_screen():
     """Ekran logowania."""
     st.title("🚉 Testy Kolejowe")
@@ -38,7 +43,14 @@ def login_screen():
         submit = st.form_submit_button("Zaloguj")
         
         if submit:
-            user = manager.authenticate_user(username, password)
+            try:
+                user = manager.authenticate_user(username, password, ip=client_ip())
+            except manager.LoginLocked as e:
+                st.error(str(e))
+                return
+            except TimeoutError:
+                st.warning("Serwer jest chwilowo przeciążony. Spróbuj zalogować się ponownie za chwilę.")
+                return
             if user:
                 st.session_state.logged_in = True
                 st.session_state.user = user
@@ -144,11 +156,9 @@ def admin_profession_management():
     """Interfejs dodawania grup zawodowych i rodzajów testów z tabelami podglądu."""
     st.header("🏗️ Zarządzanie Strukturą Systemu")
     
-    session = db.get_session()
-    
-    # Pobieramy aktualne dane do wyświetlenia w tabelach
-    all_professions = session.query(db.ProfessionGroup).all()
-    all_test_types = session.query(db.TestType).all()
+    # Aktualne dane do wyświetlenia w tabelach (cache słowników)
+    all_professions = db.get_professions()
+    all_test_types = db.get_test_types()
     
     col1, col2 = st.columns(2)
     
@@ -158,6 +168,7 @@ def admin_profession_management():
         new_prof = st.text_input("Nazwa nowej grupy (np. Rewident)", key="add_prof_input")
         if st.button("Dodaj Grupę"):
             if new_prof:
+                session = db.get_session()
                 # Sprawdzenie duplikatu przed próbą zapisu
                 exists = session.query(db.ProfessionGroup).filter_by(name=new_prof).first()
                 if exists:
@@ -165,6 +176,9 @@ def admin_profession_management():
                 else:
                     session.add(db.ProfessionGroup(name=new_prof))
                     session.commit()
+                    db.invalidate_reference_cache()
+                session.close()
+                if not exists:
                     st.success(f"Dodano grupę: {new_prof}")
                     st.rerun() # Odświeżenie, aby nowa pozycja pojawiła się w tabeli poniżej
         
@@ -183,6 +197,7 @@ def admin_profession_management():
         new_test_type = st.text_input("Nowy rodzaj testu (np. Sygnalizacja)", key="add_type_input")
         if st.button("Dodaj Rodzaj Testu"):
             if new_test_type:
+                session = db.get_session()
                 # Sprawdzenie duplikatu
                 exists = session.query(db.TestType).filter_by(name=new_test_type).first()
                 if exists:
@@ -190,6 +205,9 @@ def admin_profession_management():
                 else:
                     session.add(db.TestType(name=new_test_type))
                     session.commit()
+                    db.invalidate_reference_cache()
+                session.close()
+                if not exists:
                     st.success(f"Dodano rodzaj testu: {new_test_type}")
                     st.rerun() # Odświeżenie tabeli
         
@@ -201,8 +219,6 @@ def admin_profession_management():
         else:
             st.info("Brak zdefiniowanych rodzajów testów.")
 
-    session.close()
-
 def show_pdf_generator():
     st.header("🖨️ Generator Arkuszy PDF")
     st.write("Skonfiguruj parametry arkusza egzaminacyjnego do druku.")
@@ -210,9 +226,7 @@ def show_pdf_generator():
     # Pobieramy dane z bazy
     all_profs = manager.get_all_professions()
     # Pobieramy rodzaje testów (tematy)
-    session = db.get_session()
-    all_topics = session.query(db.TestType).all()
-    session.close()
+    all_topics = db.get_test_types()
 
     # Tworzymy słowniki mapujące Nazwa -> ID, aby Streamlit operował na prostych typach
     prof_map = {p.name: p.id for p in all_profs}
@@ -225,6 +239,8 @@ def show_pdf_generator():
         selected_prof_id = prof_map[selected_prof_name]
         
         count = st.number_input("Całkowita liczba pytań", min_value=1, max_value=200, value=30)
+        variant_count = st.number_input("Liczba wariantów arkusza", min_value=1, max_value=100, value=1,
+                                        help="Przy więcej niż jednym wariancie arkusze i klucze trafią do jednego pliku ZIP.")
     
     with col2:
         # Używamy list nazw jako opcji - to naprawi problem z wybieraniem
@@ -234,6 +250,7 @@ def show_pdf_generator():
             help="Wybierz jedną lub więcej kategorii. Pytania zostaną rozdzielone równomiernie."
         )
         logo_file = st.file_uploader("Wgraj logotyp (PNG/JPG)", type=['png', 'jpg', 'jpeg'])
+        seed_text = st.text_input("Ziarno losowania (opcjonalnie)", help="To samo ziarno daje te same warianty.")
 
     st.divider()
 
@@ -244,6 +261,11 @@ def show_pdf_generator():
             # Zamieniamy wybrane nazwy na ID
             selected_topic_ids = [topic_map[name] for name in selected_topic_names]
             
+            if variant_count > 1:
+                show_pdf_batch(selected_prof_id, selected_prof_name, selected_topic_ids, count,
+                               variant_count, seed_text.strip() or None, logo_file)
+                return
+
             with st.spinner("Losowanie pytań i generowanie plików..."):
                 # Pobranie pytań z manager.py
                 questions = manager.get_balanced_questions(selected_prof_id, selected_topic_ids, count)
@@ -273,8 +295,43 @@ def show_pdf_generator():
                 else:
                     st.error("Nie znaleziono żadnych pytań spełniających wybrane kryteria.")
 
+def show_pdf_batch(prof_id, prof_name, topic_ids, count, variant_count, seed, logo_file):
+    """Generowanie wielu wariantów arkusza naraz (równolegle) do jednego pliku ZIP."""
+    with st.spinner(f"Losowanie i generowanie {variant_count} wariantów..."):
+        variants = manager.draw_exam_variants(prof_id, topic_ids, count, variant_count, seed=seed)
+        if not variants or not variants[0]:
+            st.error("Nie znaleziono żadnych pytań spełniających wybrane kryteria.")
+            return
+        zip_buffer = pdf_service.create_variants_zip(variants, prof_name, logo_file, seed=seed)
+
+    st.success(f"Pomyślnie wygenerowano {len(variants)} wariantów po {len(variants[0])} pytań.")
+    st.download_button(
+        label="📦 Pobierz WSZYSTKIE WARIANTY (ZIP)",
+        data=zip_buffer,
+        file_name=f"Warianty_{prof_name.replace(' ', '_')}.zip",
+        mime="application/zip"
+    )
+
+def show_db_diagnostics():
+    """Podgląd puli połączeń oraz zapytań i czasu skryptu na przebieg strony (tylko Administrator)."""
+    with st.sidebar.expander("📈 Diagnostyka bazy"):
+        metrics = db.get_db_metrics()
+        pool = metrics["pool"]
+        st.write(f"Pula: {pool['checked_out']} zajęte / {pool['size']} (+{max(pool['overflow'], 0)} ponad limit)")
+        st.write(f"Oczekiwanie na połączenie: maks. {pool['max_wait_seconds'] * 1000:.0f} ms")
+        rows = [{
+            "Strona": page,
+            "Przebiegi": m["reruns"],
+            "Zapytań/przebieg": round(m["queries"] / m["reruns"], 1),
+            "ms zapytań/przebieg": round(m["seconds"] * 1000 / m["reruns"], 1),
+            "ms skryptu/przebieg": round(m["script_seconds"] * 1000 / m["reruns"], 1),
+        } for page, m in metrics["pages"].items()]
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+
 def main():
     if not st.session_state.logged_in:
+        db.set_query_page("Logowanie")
         login_screen()
         return
 
@@ -294,9 +351,16 @@ def main():
         menu_options = ["🏠 Start", "📝 Rozwiąż Test", "👤 Profil"]
 
     choice = st.sidebar.radio("Nawigacja", menu_options)
+    db.set_query_page(choice)
+
+    if user.role == config.ROLE_ADMIN:
+        show_db_diagnostics()
 
     # Logout
     if st.sidebar.button("Wyloguj"):
+        # Cała sesja - egzamin, filtry i eksporty nie mogą przejść na kolejną osobę przy tym samym terminalu
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
         st.session_state.logged_in = False
         st.session_state.user = None
         st.rerun()
@@ -326,4 +390,6 @@ def main():
     style.draw_footer()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Liczenie zapytań do bazy w ramach jednego przebiegu skryptu
+    with db.query_scope():
+        main()
\ No newline at end of file
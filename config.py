@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # --- KONFIGURACJA BAZY DANYCH (Zgodna z Docker-compose) ---
 DB_USER = os.getenv("DB_USER", "root")
@@ -9,10 +10,76 @@ DB_NAME = os.getenv("DB_NAME", "testy_db")
 # URL dla SQLAlchemy (PyMySQL jako sterownik)
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
 
+# Pula połączeń i diagnostyka zapytań
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))  # Sekundy; poniżej wait_timeout MariaDB
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_SLOW_QUERY_MS = int(os.getenv("DB_SLOW_QUERY_MS", "500"))  # Próg logowania wolnych zapytań
+
 # --- KONFIGURACJA PLIKÓW ---
 UPLOAD_DIR = "uploads"
 ALLOWED_EXTENSIONS = ["png", "jpg", "jpeg", "webp"]
 
+# Pochodne grafik (miniatury, wersje do wyświetlania i druku) - katalog wewnątrz UPLOAD_DIR
+DERIVATIVES_DIR = os.path.join(UPLOAD_DIR, "derivatives")
+IMAGE_DISPLAY_SIZE = int(os.getenv("IMAGE_DISPLAY_SIZE", "1280"))  # Dłuższy bok (px) - egzamin w przeglądarce
+IMAGE_PRINT_SIZE = int(os.getenv("IMAGE_PRINT_SIZE", "2000"))      # Dłuższy bok (px) - ok. 300 DPI w arkuszu PDF
+IMAGE_WEBP_QUALITY = 82
+
+# Serwer grafik (media_server.py): adres bazowy widziany przez przeglądarkę, np. "/media" za Nginx Proxy Managerem.
+# Pusty - grafiki idą jak dawniej przez st.image (websocket Streamlit, bez cache w przeglądarce).
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "").rstrip("/")
+MEDIA_HOST = os.getenv("MEDIA_HOST", "0.0.0.0")
+MEDIA_PORT = int(os.getenv("MEDIA_PORT", "8502"))
+
+# Masowy import: liczba pytań zapisywanych i zatwierdzanych w jednej transakcji
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+# Maksymalny rozmiar pojedynczej grafiki w paczce ZIP (MB) i liczba wątków zapisujących grafiki
+IMPORT_MAX_IMAGE_MB = int(os.getenv("IMPORT_MAX_IMAGE_MB", "25"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+# Import w tle: liczba równoległych zadań i katalog na przesłane pliki (usuwane po zakończeniu)
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", "1"))
+IMPORT_JOBS_DIR = os.getenv("IMPORT_JOBS_DIR", os.path.join(tempfile.gettempdir(), "testy_import"))
+# Proces importu odnawia znacznik życia zadania co HEARTBEAT s; zadanie bez odnowienia przez STALE s uznawane jest za przerwane
+IMPORT_JOB_HEARTBEAT_SECONDS = int(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", "10"))
+IMPORT_JOB_STALE_SECONDS = int(os.getenv("IMPORT_JOB_STALE_SECONDS", "60"))
+
+# --- EGZAMIN ---
+# Tryb przeglądarkowy: 30 pytań (bez poprawnych odpowiedzi) trafia do komponentu w jednym pakiecie,
+# nawigacja odbywa się w przeglądarce, a serwer dostaje tylko komplet odpowiedzi do oceny
+EXAM_CLIENT_MODE = os.getenv("EXAM_CLIENT_MODE", "0") == "1"
+# Magazyn postępu trwających egzaminów (wznawianie): "db" - tabela exam_progress (wiele replik),
+# "sqlite" - lokalny plik (jedna instancja, np. środowisko testowe), "none" - wyłączone
+EXAM_PROGRESS_STORE = os.getenv("EXAM_PROGRESS_STORE", "db")
+EXAM_PROGRESS_SQLITE_PATH = os.getenv("EXAM_PROGRESS_SQLITE_PATH", "exam_progress.sqlite")
+# Zmiany odpowiedzi są scalane i zapisywane co najwyżej raz na tyle sekund (na użytkownika)
+EXAM_PROGRESS_FLUSH_SECONDS = float(os.getenv("EXAM_PROGRESS_FLUSH_SECONDS", "2"))
+# Starszych niedokończonych egzaminów nie proponujemy do wznowienia
+EXAM_PROGRESS_MAX_AGE_HOURS = int(os.getenv("EXAM_PROGRESS_MAX_AGE_HOURS", "24"))
+
+# --- API EGZAMINÓW (exam_api.py) ---
+# Klucz podpisujący tokeny - wspólny dla wszystkich procesów i replik API (pusty: losowy przy starcie)
+API_SECRET = os.getenv("API_SECRET", "")
+API_PORT = int(os.getenv("API_PORT", "8503"))
+API_WORKERS = int(os.getenv("API_WORKERS", "0")) or os.cpu_count() or 1  # Procesy gunicorna (domyślnie rdzenie)
+API_TOKEN_TTL = int(os.getenv("API_TOKEN_TTL", str(8 * 3600)))  # Ważność tokenu logowania (sekundy)
+API_EXAM_TTL = int(os.getenv("API_EXAM_TTL", str(4 * 3600)))    # Czas na rozwiązanie egzaminu (sekundy)
+
+# --- CACHE ---
+# Maksymalny wiek indeksu pul pytań w pamięci (sekundy); zabezpiecza inne procesy/repliki
+QUESTION_POOL_TTL = int(os.getenv("QUESTION_POOL_TTL", "300"))
+# Maksymalny wiek słowników (grupy zawodowe, rodzaje testów) w pamięci (sekundy)
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "600"))
+
+# --- GENEROWANIE PDF ---
+# Liczba procesów renderujących warianty arkuszy (domyślnie liczba rdzeni)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+# Rozdzielczość grafik osadzanych w PDF oraz pojemność cache przeskalowanych grafik (liczba pozycji)
+PDF_IMAGE_DPI = int(os.getenv("PDF_IMAGE_DPI", "300"))
+PDF_IMAGE_CACHE_SIZE = int(os.getenv("PDF_IMAGE_CACHE_SIZE", "512"))
+
 # --- DANE STARTOWE SYSTEMU ---
 DEFAULT_ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 DEFAULT_ADMIN_PASS = os.getenv("ADMIN_PASS", "admin123")
@@ -20,6 +87,18 @@ DEFAULT_ADMIN_PASS = os.getenv("ADMIN_PASS", "admin123")
 # Domyślne grupy zawodowe (tworzone przy starcie)
 DEFAULT_PROFESSIONS = ["Maszynista", "Kierownik pociągu", "Konduktor", "Rewident"]
 
+# --- LOGOWANIE ---
+# Koszt bcrypt (log2 liczby rund); hasła o innym koszcie są przeliczane przy logowaniu
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Pula wątków liczących bcrypt i limit oczekujących operacji (nadmiar dostaje odmowę zamiast kolejki)
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "64"))
+AUTH_TIMEOUT = int(os.getenv("AUTH_TIMEOUT", "15"))  # Sekundy
+# Blokada po nieudanych próbach (okno czasowe w sekundach), liczona wspólnie dla wszystkich replik
+LOGIN_MAX_FAILURES_USER = int(os.getenv("LOGIN_MAX_FAILURES_USER", "5"))
+LOGIN_MAX_FAILURES_IP = int(os.getenv("LOGIN_MAX_FAILURES_IP", "20"))
+LOGIN_LOCKOUT_SECONDS = int(os.getenv("LOGIN_LOCKOUT_SECONDS", "300"))
+
 # Role w systemie
 ROLE_ADMIN = "Administrator"
 ROLE_EDITOR = "Edytor"
@@ -27,4 +106,4 @@ ROLE_USER = "Użytkownik"
 
 # --- WARSTWA WIZUALNA (CSS) ---
 # Optymalizacja pod urządzenia mobilne, jasne tło, pastelowe przyciski
-QUESTION_IMAGE_SIZE = 200
+QUESTION_IMAGE_SIZE = 200  # Dłuższy bok miniatury (px) - podglądy w edytorze
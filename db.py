@@ -1,7 +1,19 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, ForeignKey, Table
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from array import array
+from collections import Counter, namedtuple
+from datetime import datetime
+from sqlalchemy import (create_engine, Column, Integer, String, Float, Text, Boolean, DateTime, ForeignKey, Table,
+                        Index, insert, update, select, bindparam, func, or_)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker, relationship
-from config import DATABASE_URL  # Import konfiguracji
+from sqlalchemy.pool import QueuePool
+from config import (DATABASE_URL, QUESTION_POOL_TTL, REFERENCE_CACHE_TTL, DB_POOL_SIZE, DB_MAX_OVERFLOW,  # Import konfiguracji
+                    DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_ECHO, DB_SLOW_QUERY_MS)
 
 Base = declarative_base()
 
@@ -18,14 +30,18 @@ user_profession_m2m = Table(
 question_profession_m2m = Table(
     'question_profession', Base.metadata,
     Column('question_id', Integer, ForeignKey('questions.id', ondelete="CASCADE"), primary_key=True),
-    Column('profession_id', Integer, ForeignKey('profession_groups.id', ondelete="CASCADE"), primary_key=True)
+    Column('profession_id', Integer, ForeignKey('profession_groups.id', ondelete="CASCADE"), primary_key=True),
+    # Odwrotna kolejność względem PK - filtrowanie po grupie zawodowej (losowanie pytań)
+    Index('ix_question_profession_profession', 'profession_id', 'question_id')
 )
 
 # Powiązanie Pytań z Rodzajami Testów
 question_test_type_m2m = Table(
     'question_test_type', Base.metadata,
     Column('question_id', Integer, ForeignKey('questions.id', ondelete="CASCADE"), primary_key=True),
-    Column('test_type_id', Integer, ForeignKey('test_types.id', ondelete="CASCADE"), primary_key=True)
+    Column('test_type_id', Integer, ForeignKey('test_types.id', ondelete="CASCADE"), primary_key=True),
+    # Odwrotna kolejność względem PK - filtrowanie po rodzaju testu (losowanie, tabela w edytorze)
+    Index('ix_question_test_type_test_type', 'test_type_id', 'question_id')
 )
 
 # --- MODELE ---
@@ -77,21 +93,219 @@ class Question(Base):
     # Statystyki zdawalności
     total_attempts = Column(Integer, default=0)
     correct_attempts = Column(Integer, default=0)
-    pass_rate = Column(Float, default=0.0)
+    pass_rate = Column(Float, nullable=False, default=0.0, server_default="0")  # Bez NULL - filtr edytora korzysta z indeksu
 
     # Relacje Many-to-Many
     professions = relationship("ProfessionGroup", secondary=question_profession_m2m, backref="questions")
     test_types = relationship("TestType", secondary=question_test_type_m2m, backref="questions")
 
+    __table_args__ = (
+        # Filtr zdawalności w tabeli pytań edytora
+        Index('ix_questions_pass_rate', 'pass_rate'),
+    )
+
+class ExamAttempt(Base):
+    """Historia podejść do egzaminu (jeden wiersz na zakończony test)."""
+    __tablename__ = 'exam_attempts'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    profession_id = Column(Integer, ForeignKey('profession_groups.id', ondelete="SET NULL"), nullable=True)
+    test_type_id = Column(Integer, ForeignKey('test_types.id', ondelete="SET NULL"), nullable=True)
+    score = Column(Integer, nullable=False)
+    question_count = Column(Integer, nullable=False)
+    duration_seconds = Column(Integer, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=False, default=datetime.now)
+    exam_nonce = Column(String(32), nullable=True)  # Identyfikator egzaminu z API (jedno podejście na token)
+
+    answers = relationship("ExamAnswer", backref="attempt", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Historia użytkownika: WHERE user_id = ? ORDER BY finished_at
+        Index('ix_exam_attempts_user_finished', 'user_id', 'finished_at'),
+        # Ponowne lub równoległe wysłanie tego samego egzaminu łamie klucz zamiast liczyć się drugi raz
+        Index('ux_exam_attempts_nonce', 'exam_nonce', unique=True),
+    )
+
+class ExamAnswer(Base):
+    """Odpowiedzi udzielone w ramach podejścia (kolejność jak w teście)."""
+    __tablename__ = 'exam_answers'
+    attempt_id = Column(Integer, ForeignKey('exam_attempts.id', ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)  # Numer pytania w teście (0-29)
+    # Usunięcie pytania nie zmienia historii: odpowiedź zostaje (z NULL), więc score/question_count podejścia się zgadzają
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete="SET NULL"), nullable=True)
+    chosen_ans = Column(String(1), nullable=True)  # A, B, C lub NULL (brak odpowiedzi)
+    is_correct = Column(Boolean, nullable=False)
+
+    __table_args__ = (
+        # Analiza pytań (rozkład odpowiedzi) obsłużona w całości z indeksu
+        Index('ix_exam_answers_question', 'question_id', 'chosen_ans', 'is_correct'),
+    )
+
+class ImportJob(Base):
+    """Zadanie masowego importu wykonywane w tle (postęp odczytywany przez edytor)."""
+    __tablename__ = 'import_jobs'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="SET NULL"), nullable=True)
+    host = Column(String(255), nullable=True)  # Kontener/proces wykonujący zadanie (informacyjnie)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, done, failed
+    excel_name = Column(String(255), nullable=True)
+    zip_name = Column(String(255), nullable=True)
+    total_rows = Column(Integer, default=0)
+    rows_done = Column(Integer, default=0)
+    success = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    error_rows = Column(Text, nullable=True)  # JSON: [[wiersz, opis], ...]
+    message = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # Odnawiane przez proces zadania; brak odnowienia = zadanie przerwane
+
+    __table_args__ = (
+        Index('ix_import_jobs_user_created', 'user_id', 'created_at'),
+    )
+
+class ExamProgress(Base):
+    """Postęp trwającego egzaminu (jeden na użytkownika) - wznowienie po restarcie lub na innej replice."""
+    __tablename__ = 'exam_progress'
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    seq = Column(Integer, nullable=False, default=0)  # Numer zapisu - starszy stan nie nadpisze nowszego
+    profession_id = Column(Integer, nullable=True)
+    test_type_id = Column(Integer, nullable=True)
+    question_ids = Column(Text, nullable=False)  # JSON: [id, ...] w kolejności z testu
+    answers = Column(Text, nullable=False)  # JSON: ["A", null, ...] na pozycjach jak question_ids
+    current_idx = Column(Integer, nullable=False, default=0)
+    phase = Column(String(20), nullable=False, default="testing")  # testing, review
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
+
+class LoginFailure(Base):
+    """Nieudane próby logowania - wspólne dla wszystkich procesów i replik (Streamlit i API)."""
+    __tablename__ = 'login_failures'
+    id = Column(Integer, primary_key=True)
+    key = Column(String(100), nullable=False)  # 'user:<nazwa>' lub 'ip:<adres>'
+    failed_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        # Liczenie prób w oknie blokady i usuwanie wygasłych wpisów
+        Index('ix_login_failures_key_failed', 'key', 'failed_at'),
+        Index('ix_login_failures_failed', 'failed_at'),
+    )
+
 # --- ZARZĄDZANIE SILNIKIEM I SESJĄ ---
 
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool mierzący czas oczekiwania na wolne połączenie."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            _record_pool_wait(time.perf_counter() - start)
+
 engine = create_engine(
     DATABASE_URL, 
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_timeout=DB_POOL_TIMEOUT,
     pool_pre_ping=True,  # Automatyczne odświeżanie połączenia (ważne dla MariaDB)
-    echo=False           # Ustaw na True podczas debugowania
+    echo=DB_ECHO         # DB_ECHO=1 podczas debugowania
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- DIAGNOSTYKA: liczniki zapytań i puli połączeń ---
+
+class QueryStats:
+    """Liczba i łączny czas zapytań w ramach jednego zakresu (np. jednego przebiegu strony)."""
+    __slots__ = ("page", "queries", "seconds", "started")
+
+    def __init__(self, page=None):
+        self.page = page
+        self.queries = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+_current_stats = ContextVar("db_query_stats", default=None)
+_metrics_lock = threading.Lock()
+_page_metrics = {}  # strona -> {"reruns", "queries", "seconds", "script_seconds"}
+_pool_metrics = {"waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+def _record_pool_wait(seconds):
+    with _metrics_lock:
+        _pool_metrics["waits"] += 1
+        _pool_metrics["wait_seconds"] += seconds
+        _pool_metrics["max_wait_seconds"] = max(_pool_metrics["max_wait_seconds"], seconds)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        params = repr(parameters)
+        print(f"Wolne zapytanie ({elapsed * 1000:.0f} ms): {statement} | parametry: {params[:500]}")
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+@contextmanager
+def query_scope(page=None):
+    """
+    Zlicza zapytania i czas wykonania bloku (np. jeden przebieg skryptu Streamlit).
+    Nazwę strony można uzupełnić później (stats.page = ...). Wynik trafia do get_db_metrics().
+    Zakres otwarty wewnątrz innego (np. fragment w pełnym przebiegu) dolicza się do zewnętrznego.
+    """
+    outer = _current_stats.get()
+    if outer is not None:
+        yield outer
+        return
+    stats = QueryStats(page)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        elapsed = time.perf_counter() - stats.started
+        with _metrics_lock:
+            m = _page_metrics.setdefault(stats.page or "-",
+                                         {"reruns": 0, "queries": 0, "seconds": 0.0, "script_seconds": 0.0})
+            m["reruns"] += 1
+            m["queries"] += stats.queries
+            m["seconds"] += stats.seconds
+            m["script_seconds"] += elapsed
+
+def set_query_page(page):
+    """Przypisuje nazwę strony do bieżącego zakresu liczenia zapytań."""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.page = page
+
+def get_db_metrics():
+    """Stan puli połączeń oraz zagregowane liczniki zapytań per strona."""
+    pool = engine.pool
+    with _metrics_lock:
+        return {
+            "pool": {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checked_in": pool.checkedin(),
+                **_pool_metrics,
+            },
+            "pages": {name: dict(m) for name, m in _page_metrics.items()},
+        }
+
 def init_db():
     """Inicjalizuje tabele. Wywoływane przy starcie app.py."""
     Base.metadata.create_all(bind=engine)
@@ -100,20 +314,304 @@ def get_session():
     """Tworzy i zwraca nową sesję bazy danych."""
     return SessionLocal()
 
-def update_question_stats(question_id, is_correct):
-    """Aktualizuje statystyki pytania po zakończeniu testu."""
+def _question_stats_update(results):
+    """
+    Buduje zbiorcze zapytanie UPDATE statystyk oraz jego parametry (executemany).
+    results: pary (question_id, is_correct) - cały wektor odpowiedzi; powtórzone ID (random.choices) są sumowane.
+    Inkrementacje wykonywane są po stronie SQL, więc równoległe zakończenia testów nie gubią wyników.
+    """
+    attempts = Counter()
+    correct = Counter()
+    for question_id, is_correct in results:
+        attempts[question_id] += 1
+        if is_correct:
+            correct[question_id] += 1
+
+    params = [
+        {"q_id": q_id, "n_total": n, "n_ok": correct[q_id]}
+        for q_id, n in sorted(attempts.items())  # Stała kolejność blokad wierszy (brak deadlocków)
+    ]
+
+    t = Question.__table__
+    old_total = func.coalesce(t.c.total_attempts, 0)
+    old_correct = func.coalesce(t.c.correct_attempts, 0)
+    # pass_rate liczone jako pierwsze, z wartości sprzed aktualizacji - MariaDB wykonuje
+    # przypisania SET od lewej, więc kolejność jest jawna (ordered_values)
+    stmt = (
+        update(t)
+        .where(t.c.id == bindparam("q_id"))
+        .ordered_values(
+            (t.c.pass_rate, func.round(
+                (old_correct + bindparam("n_ok")) * 100.0 / (old_total + bindparam("n_total")), 2)),
+            (t.c.total_attempts, old_total + bindparam("n_total")),
+            (t.c.correct_attempts, old_correct + bindparam("n_ok")),
+        )
+    )
+    return stmt, params
+
+def save_exam_attempt(user_id, profession_id, test_type_id, answers, started_at=None, exam_nonce=None):
+    """
+    Zapisuje podejście do egzaminu wraz z odpowiedziami i aktualizuje statystyki pytań.
+    answers: lista krotek (question_id, chosen_ans, is_correct) w kolejności z testu.
+    exam_nonce: unikalny identyfikator egzaminu - drugi zapis z tym samym kończy się błędem (None).
+    Wszystko w jednej transakcji. Zwraca ID podejścia lub None w razie błędu.
+    """
+    finished_at = datetime.now()
+    duration = int((finished_at - started_at).total_seconds()) if started_at else None
+    score = sum(1 for _, _, is_correct in answers if is_correct)
+
+    stats_stmt, stats_params = _question_stats_update((q_id, ok) for q_id, _, ok in answers)
+
+    session = get_session()
+    try:
+        result = session.execute(insert(ExamAttempt.__table__).values(
+            user_id=user_id,
+            profession_id=profession_id,
+            test_type_id=test_type_id,
+            score=score,
+            question_count=len(answers),
+            duration_seconds=duration,
+            started_at=started_at,
+            finished_at=finished_at,
+            exam_nonce=exam_nonce
+        ))
+        attempt_id = result.inserted_primary_key[0]
+
+        if answers:
+            session.execute(insert(ExamAnswer.__table__), [
+                {"attempt_id": attempt_id, "position": pos, "question_id": q_id,
+                 "chosen_ans": chosen, "is_correct": bool(ok)}
+                for pos, (q_id, chosen, ok) in enumerate(answers)
+            ])
+        if stats_params:
+            session.execute(stats_stmt, stats_params)
+        session.commit()
+        return attempt_id
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd zapisu podejścia: {e}")
+        return None
+    finally:
+        session.close()
+
+# --- INDEKS PUL PYTAŃ (cache w procesie) ---
+
+# (profession_id, test_type_id) -> (czas_zbudowania, array ID pytań)
+_question_pools = {}
+_question_pools_lock = threading.Lock()
+
+def invalidate_question_pool():
+    """Unieważnia indeks pul pytań. Wywoływać po każdym dodaniu/edycji/usunięciu pytań."""
+    with _question_pools_lock:
+        _question_pools.clear()
+    # Nowe egzaminy dostaną świeże migawki; trwające zachowują swoje
+    with _exam_questions_lock:
+        _exam_questions.clear()
+
+def get_question_pool(profession_id, test_type_id):
+    """
+    Zwraca zwartą tablicę (array) ID pytań dla pary grupa zawodowa / rodzaj testu.
+    Zapytanie obejmuje wyłącznie tabele powiązań; wynik trzymany jest w pamięci
+    procesu do unieważnienia lub upływu QUESTION_POOL_TTL sekund.
+    """
+    key = (profession_id, test_type_id)
+    entry = _question_pools.get(key)
+    if entry and time.monotonic() - entry[0] < QUESTION_POOL_TTL:
+        return entry[1]
+
+    session = get_session()
+    try:
+        rows = session.query(question_profession_m2m.c.question_id).join(
+            question_test_type_m2m,
+            question_test_type_m2m.c.question_id == question_profession_m2m.c.question_id
+        ).filter(
+            question_profession_m2m.c.profession_id == profession_id,
+            question_test_type_m2m.c.test_type_id == test_type_id
+        ).distinct().order_by(question_profession_m2m.c.question_id)
+        pool = array('l', (r[0] for r in rows))
+    finally:
+        session.close()
+
+    with _question_pools_lock:
+        _question_pools[key] = (time.monotonic(), pool)
+    return pool
+
+def get_questions_by_ids(question_ids):
+    """Pobiera pytania jednym zapytaniem IN, zachowując kolejność i powtórzenia z listy ID."""
+    if not question_ids:
+        return []
+    session = get_session()
+    try:
+        rows = session.query(Question).filter(Question.id.in_(set(question_ids))).all()
+    finally:
+        session.close()
+    by_id = {q.id: q for q in rows}
+    return [by_id[q_id] for q_id in question_ids if q_id in by_id]
+
+# --- MIGAWKI PYTAŃ EGZAMINU (współdzielone między sesjami) ---
+
+class ExamQuestion:
+    """Niemutowalna, zwarta migawka pytania na potrzeby trwającego egzaminu."""
+    __slots__ = ("id", "content", "image_path", "ans_a", "image_a", "ans_b", "image_b",
+                 "ans_c", "image_c", "correct_ans", "comment", "__weakref__")
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExamQuestion jest tylko do odczytu")
+
+    def __repr__(self):
+        return f"<ExamQuestion {self.id}>"
+
+_EXAM_QUESTION_COLUMNS = [getattr(Question, name) for name in ExamQuestion.__slots__[:-1]]
+
+# ID pytania -> migawka; wpis znika, gdy żadna sesja już go nie trzyma
+_exam_questions = weakref.WeakValueDictionary()
+_exam_questions_lock = threading.Lock()
+
+def get_exam_questions(question_ids):
+    """
+    Zwraca słownik {id: ExamQuestion} dla unikalnych ID z listy.
+    Migawki są internowane w pamięci procesu, więc wszystkie sesje losujące
+    to samo pytanie współdzielą jeden obiekt; brakujące doczytujemy jednym zapytaniem.
+    """
+    wanted = set(question_ids)
+    found = {}
+    with _exam_questions_lock:
+        for q_id in wanted:
+            snapshot = _exam_questions.get(q_id)
+            if snapshot is not None:
+                found[q_id] = snapshot
+
+    missing = wanted - found.keys()
+    if missing:
+        session = get_session()
+        try:
+            rows = session.query(*_EXAM_QUESTION_COLUMNS).filter(Question.id.in_(missing)).all()
+        finally:
+            session.close()
+        with _exam_questions_lock:
+            for row in rows:
+                # setdefault: równoległa sesja mogła już wstawić tę samą migawkę
+                found[row[0]] = _exam_questions.setdefault(row[0], ExamQuestion(*row))
+    return found
+
+# --- SŁOWNIKI (cache w procesie) ---
+
+# Niemutowalny rekord słownikowy zamiast odłączonej instancji ORM
+RefItem = namedtuple('RefItem', ['id', 'name'])
+
+# Klasa modelu -> (czas_zbudowania, krotka RefItem)
+_reference_cache = {}
+_reference_cache_lock = threading.Lock()
+
+def invalidate_reference_cache():
+    """Unieważnia cache grup zawodowych i rodzajów testów (po dodaniu nowych pozycji)."""
+    with _reference_cache_lock:
+        _reference_cache.clear()
+
+def _get_reference(model):
+    entry = _reference_cache.get(model)
+    if entry and time.monotonic() - entry[0] < REFERENCE_CACHE_TTL:
+        return entry[1]
+
+    session = get_session()
+    try:
+        items = tuple(RefItem(r.id, r.name) for r in session.query(model.id, model.name).order_by(model.id))
+    finally:
+        session.close()
+
+    with _reference_cache_lock:
+        _reference_cache[model] = (time.monotonic(), items)
+    return items
+
+def get_professions():
+    """Zwraca wszystkie grupy zawodowe jako krotkę RefItem(id, name) z cache."""
+    return _get_reference(ProfessionGroup)
+
+def get_test_types():
+    """Zwraca wszystkie rodzaje testów jako krotkę RefItem(id, name) z cache."""
+    return _get_reference(TestType)
+
+# --- PRZEGLĄDANIE PYTAŃ (edytor) ---
+
+def question_filters(test_type_id=None, profession_id=None, min_pass_rate=None, max_pass_rate=None, min_id=None):
+    """Buduje listę warunków WHERE dla filtrów edytora."""
+    clauses = []
+    if test_type_id:
+        clauses.append(Question.id.in_(
+            select(question_test_type_m2m.c.question_id).where(question_test_type_m2m.c.test_type_id == test_type_id)))
+    if profession_id:
+        clauses.append(Question.id.in_(
+            select(question_profession_m2m.c.question_id).where(question_profession_m2m.c.profession_id == profession_id)))
+    # Goła kolumna (NOT NULL od migracji 6) - warunek zakresu obsługuje ix_questions_pass_rate
+    if min_pass_rate is not None:
+        clauses.append(Question.pass_rate >= min_pass_rate)
+    if max_pass_rate is not None:
+        clauses.append(Question.pass_rate <= max_pass_rate)
+    if min_id:
+        clauses.append(Question.id >= min_id)
+    return clauses
+
+def list_questions(after_id=None, limit=50, **filters):
+    """
+    Stronicowanie po kluczu (keyset): zwraca (wiersze, czy_jest_dalej).
+    Pobiera tylko kolumny wyświetlane w tabeli, treść skróconą do 200 znaków.
+    """
+    session = get_session()
+    try:
+        query = session.query(
+            Question.id,
+            func.substr(Question.content, 1, 200).label("content"),
+            Question.total_attempts,
+            Question.pass_rate
+        ).filter(*question_filters(**filters))
+        if after_id:
+            query = query.filter(Question.id > after_id)
+        rows = query.order_by(Question.id).limit(limit + 1).all()
+    finally:
+        session.close()
+    return rows[:limit], len(rows) > limit
+
+def count_questions(**filters):
+    """Liczba pytań spełniających filtry edytora."""
+    session = get_session()
+    try:
+        return session.query(func.count(Question.id)).filter(*question_filters(**filters)).scalar()
+    finally:
+        session.close()
+
+def search_questions(term, limit=20):
+    """Wyszukiwanie pytań po ID lub fragmencie treści (podpowiedzi przy wyborze pytania)."""
+    term = (term or "").strip()
+    session = get_session()
+    try:
+        query = session.query(Question.id, func.substr(Question.content, 1, 60).label("content"))
+        if term:
+            cond = Question.content.contains(term, autoescape=True)
+            if term.isdigit():
+                cond = or_(Question.id == int(term), cond)
+            query = query.filter(cond)
+        return query.order_by(Question.id.desc()).limit(limit).all()
+    finally:
+        session.close()
+
+def reset_questions_stats(**filters):
+    """Zeruje statystyki pytań spełniających filtry jednym zapytaniem UPDATE. Zwraca liczbę wierszy."""
     session = get_session()
     try:
-        q = session.query(Question).filter(Question.id == question_id).first()
-        if q:
-            q.total_attempts += 1
-            if is_correct:
-                q.correct_attempts += 1
-            # Wyliczenie procentowe
-            q.pass_rate = round((q.correct_attempts / q.total_attempts) * 100, 2)
-            session.commit()
+        result = session.execute(
+            update(Question.__table__)
+            .where(*question_filters(**filters))
+            .values(total_attempts=0, correct_attempts=0, pass_rate=0.0)
+        )
+        session.commit()
+        return result.rowcount
     except Exception as e:
         session.rollback()
-        print(f"Błąd aktualizacji statystyk: {e}")
+        print(f"Błąd resetu statystyk: {e}")
+        return 0
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
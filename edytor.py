@@ -1,25 +1,106 @@
 import streamlit as st
 import pandas as pd
 import os
-import uuid
 import config
 import style  # <--- NASZ NOWY MODUŁ STYLÓW
-from db import get_session, Question, ProfessionGroup, TestType
-from importer import run_mass_import
+import obrazy
+from db import (get_session, Question, ProfessionGroup, TestType, get_professions, get_test_types,
+                invalidate_question_pool, list_questions, count_questions, search_questions, reset_questions_stats)
+import json
+import glob
+import time
+import shutil
+import tempfile
+from importer import start_import_job, get_latest_import_job, ACTIVE_STATUSES
+from exporter import export_questions
+
+PAGE_SIZE = 50  # Liczba wierszy na stronę w tabeli pytań
 
 def save_uploaded_file(uploaded_file):
-    """Pomocnicza funkcja do zapisu plików graficznych."""
+    """Pomocnicza funkcja do zapisu plików graficznych (magazyn adresowany treścią)."""
     if uploaded_file is not None:
-        if not os.path.exists("uploads"):
-            os.makedirs("uploads")
         ext = uploaded_file.name.split('.')[-1]
-        filename = f"{uuid.uuid4()}.{ext}"
-        filepath = os.path.join("uploads", filename)
-        with open(filepath, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return filepath
+        return obrazy.store_file(uploaded_file, ext)
     return None
 
+def load_selected(session, model, options, names):
+    """Zamienia wybrane nazwy (rekordy słownikowe z cache) na obiekty ORM w bieżącej sesji."""
+    ids = [options[name].id for name in names]
+    if not ids:
+        return []
+    return session.query(model).filter(model.id.in_(ids)).all()
+
+EXPORT_PREFIX = "testy_eksport_"
+EXPORT_MAX_AGE = 3600  # Nieodebrane eksporty starsze niż godzina są usuwane przy kolejnym eksporcie
+
+def remove_stale_exports():
+    """Usuwa katalogi eksportów, których nikt nie pobrał (zamknięta karta, wylogowanie)."""
+    now = time.time()
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), EXPORT_PREFIX + "*")):
+        try:
+            if now - os.path.getmtime(path) > EXPORT_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def export_download(path):
+    """
+    Dane przycisku pobierania: plik czytany dopiero po kliknięciu (w osobnym wątku Streamlit)
+    i od razu usuwany z dysku - sesja przechowuje tylko ścieżkę, nie treść.
+    """
+    def read():
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+        if not os.listdir(os.path.dirname(path)):
+            os.rmdir(os.path.dirname(path))
+        return data
+    return read
+
+def forget_export_file(file_name):
+    """Pobrany plik znika z listy (drugie kliknięcie nie trafi na usunięty plik)."""
+    export_files = st.session_state.get("export_files", {})
+    export_files.pop(file_name, None)
+    if not export_files:
+        st.session_state.pop("export_files", None)
+
+def show_import_progress(user_id):
+    """Panel ostatniego importu; odświeżanie co 2 s działa tylko, gdy zadanie jest w kolejce lub w toku."""
+    job = get_latest_import_job(user_id)
+    if job and job.status in ACTIVE_STATUSES:
+        poll_import_progress(user_id)
+    else:
+        show_import_job(job)
+
+@st.fragment(run_every=2)
+def poll_import_progress(user_id):
+    """Odświeżany fragment (przeładowuje tylko tę część strony) - do zakończenia zadania."""
+    job = get_latest_import_job(user_id)
+    show_import_job(job)
+    if not job or job.status not in ACTIVE_STATUSES:
+        st.rerun()  # Pełny przebieg rysuje wynik już bez cyklicznego odświeżania
+
+def show_import_job(job):
+    """Stan zadania importu: postęp, wynik z listą błędnych wierszy albo opis błędu."""
+    if not job:
+        return
+
+    st.divider()
+    st.write(f"**Ostatni import:** {job.excel_name} + {job.zip_name} ({job.created_at:%Y-%m-%d %H:%M})")
+    if job.status in ACTIVE_STATUSES:
+        total = job.total_rows or 0
+        done = job.rows_done or 0
+        label = "W kolejce..." if job.status == "queued" else f"Przetworzono {done} z {total or '?'} wierszy, błędy: {job.errors or 0}"
+        st.progress(done / total if total else 0.0, text=label)
+    elif job.status == "done":
+        st.success(f"Import zakończony! Sukcesy: {job.success}, Błędy: {job.errors}")
+        error_rows = json.loads(job.error_rows) if job.error_rows else []
+        if error_rows:
+            st.dataframe(pd.DataFrame(error_rows, columns=["Wiersz", "Błąd"]),
+                         use_container_width=True, hide_index=True)
+    else:
+        st.error(f"Import nie powiódł się: {job.message}")
+
 def show_editor_ui():
     # 1. Aplikujemy pastelowe style i kontrastowe napisy
     style.apply_custom_css()
@@ -29,15 +110,14 @@ def show_editor_ui():
     session = get_session()
     
     # Pobranie danych do filtrów i list
-    all_professions = session.query(ProfessionGroup).all()
-    all_test_types = session.query(TestType).all()
-    all_questions = session.query(Question).all()
+    all_professions = get_professions()
+    all_test_types = get_test_types()
     
     prof_options = {p.name: p for p in all_professions}
     type_options = {t.name: t for t in all_test_types}
 
     # Menu boczne (Pastelowe przyciski dzięki style.py)
-    menu = ["Dodaj nowe pytanie", "Edytuj / Usuń istniejące", "Tabela pytań", "🚀 Masowy Import"]
+    menu = ["Dodaj nowe pytanie", "Edytuj / Usuń istniejące", "Tabela pytań", "🚀 Masowy Import", "📤 Eksport"]
     choice = st.sidebar.selectbox("Menu Edytora", menu)
 
     # --- LOGIKA: DODAWANIE NOWEGO PYTANIA ---
@@ -89,23 +169,25 @@ def show_editor_ui():
                         image_c=save_uploaded_file(ans_data['img_C']),
                         comment=comment
                     )
-                    new_q.professions = [prof_options[name] for name in selected_profs]
-                    new_q.test_types = [type_options[name] for name in selected_types]
+                    new_q.professions = load_selected(session, ProfessionGroup, prof_options, selected_profs)
+                    new_q.test_types = load_selected(session, TestType, type_options, selected_types)
                     
                     session.add(new_q)
                     session.commit()
+                    invalidate_question_pool()
                     st.success("Pytanie zostało pomyślnie dodane!")
                     st.rerun()
 
     # --- LOGIKA: EDYCJA / USUWANIE ---
     elif choice == "Edytuj / Usuń istniejące":
         st.subheader("✏️ Zarządzanie pytaniami")
-        q_list = {f"ID {q.id}: {q.content[:60]}...": q for q in all_questions}
+        # Podpowiedzi z serwera: pobieramy tylko ID i początek treści pasujących pytań
+        search_term = st.text_input("Szukaj pytania (ID lub fragment treści)")
+        q_list = {f"ID {r.id}: {r.content}...": r.id for r in search_questions(search_term)}
         selected_q_label = st.selectbox("Wybierz pytanie do modyfikacji", [""] + list(q_list.keys()))
+        q = session.get(Question, q_list[selected_q_label]) if selected_q_label else None
         
-        if selected_q_label:
-            q = q_list[selected_q_label]
-            
+        if q:
             with st.form("edit_question_form"):
                 e_q_col1, e_q_col2 = st.columns([2, 1])
                 with e_q_col1:
@@ -125,7 +207,7 @@ def show_editor_ui():
                         new_ans[f'txt_{label}'] = st.text_input(f"Odp {label}", value=field_txt if field_txt else "")
                     with c_img:
                         if field_img:
-                            st.image(field_img, width=100)
+                            style.st_image(field_img, "thumb", width=100)
                         new_ans[f'img_{label}'] = st.file_uploader(f"Zmień grafikę {label}", type=config.ALLOWED_EXTENSIONS, key=f"edit_img_{label}")
 
                 st.divider()
@@ -144,47 +226,70 @@ def show_editor_ui():
                     q.ans_a, q.ans_b, q.ans_c = new_ans['txt_A'], new_ans['txt_B'], new_ans['txt_C']
                     q.correct_ans = new_correct
                     q.comment = new_comment
+                    old_images = [q.image_path, q.image_a, q.image_b, q.image_c]
                     
                     if new_img_q: q.image_path = save_uploaded_file(new_img_q)
                     if new_ans['img_A']: q.image_a = save_uploaded_file(new_ans['img_A'])
                     if new_ans['img_B']: q.image_b = save_uploaded_file(new_ans['img_B'])
                     if new_ans['img_C']: q.image_c = save_uploaded_file(new_ans['img_C'])
                     
-                    q.professions = [prof_options[name] for name in new_profs]
-                    q.test_types = [type_options[name] for name in new_types]
+                    q.professions = load_selected(session, ProfessionGroup, prof_options, new_profs)
+                    q.test_types = load_selected(session, TestType, type_options, new_types)
                     session.commit()
+                    invalidate_question_pool()
+                    obrazy.release_files(old_images)  # Podmienione grafiki, jeśli nikt już ich nie używa
                     st.success("Zmiany zostały zapisane.")
                     st.rerun()
 
                 # Przycisk Usuń będzie pastelowy czerwony dzięki CSS w style.py
                 if col_b2.form_submit_button("USUŃ PYTANIE", use_container_width=True):
+                    old_images = [q.image_path, q.image_a, q.image_b, q.image_c]
                     session.delete(q)
                     session.commit()
+                    invalidate_question_pool()
+                    obrazy.release_files(old_images)
                     st.warning("Pytanie zostało usunięte z bazy.")
                     st.rerun()
 
     # --- LOGIKA: TABELA PYTAŃ ---
     elif choice == "Tabela pytań":
         st.subheader("📊 Statystyki zdawalności pytań")
-        type_names = ["Wszystkie"] + [t.name for t in all_test_types]
-        selected_type_name = st.selectbox("Filtruj według rodzaju testu:", type_names)
+        f_col1, f_col2, f_col3, f_col4 = st.columns([2, 2, 2, 1])
+        with f_col1:
+            type_names = ["Wszystkie"] + [t.name for t in all_test_types]
+            selected_type_name = st.selectbox("Filtruj według rodzaju testu:", type_names)
+        with f_col2:
+            prof_names = ["Wszystkie"] + [p.name for p in all_professions]
+            selected_prof_name = st.selectbox("Grupa zawodowa:", prof_names)
+        with f_col3:
+            rate_range = st.slider("Zdawalność (%)", 0.0, 100.0, (0.0, 100.0))
+        with f_col4:
+            min_id = st.number_input("Od ID", min_value=0, value=0, step=1)
 
-        query = session.query(Question)
-        if selected_type_name != "Wszystkie":
-            selected_type_obj = type_options[selected_type_name]
-            query = query.filter(Question.test_types.any(id=selected_type_obj.id))
-        
-        filtered_questions = query.all()
+        filters = {
+            "test_type_id": type_options[selected_type_name].id if selected_type_name != "Wszystkie" else None,
+            "profession_id": prof_options[selected_prof_name].id if selected_prof_name != "Wszystkie" else None,
+            "min_pass_rate": rate_range[0] if rate_range[0] > 0 else None,
+            "max_pass_rate": rate_range[1] if rate_range[1] < 100 else None,
+            "min_id": min_id or None,
+        }
+
+        # Stronicowanie po kluczu: stos ostatnich ID poprzednich stron, zerowany przy zmianie filtrów
+        if st.session_state.get("q_table_filters") != filters:
+            st.session_state.q_table_filters = filters
+            st.session_state.q_table_pages = [None]
+        pages = st.session_state.q_table_pages
+
+        rows, has_more = list_questions(after_id=pages[-1], limit=PAGE_SIZE, **filters)
 
-        if filtered_questions:
+        if rows:
             data = []
-            for q in filtered_questions:
-                calc_pass_rate = (q.correct_attempts / q.total_attempts * 100) if q.total_attempts > 0 else 0.0
+            for r in rows:
                 data.append({
-                    "ID": q.id,
-                    "Pytanie": q.content,
-                    "Użyć": q.total_attempts,
-                    "Zdawalność": calc_pass_rate
+                    "ID": r.id,
+                    "Pytanie": r.content,
+                    "Użyć": r.total_attempts or 0,
+                    "Zdawalność": r.pass_rate or 0.0
                 })
             
             df = pd.DataFrame(data)
@@ -199,22 +304,27 @@ def show_editor_ui():
                 hide_index=True
             )
 
+            p_col1, p_col2, p_col3 = st.columns([1, 2, 1])
+            if p_col1.button("⬅️ Poprzednia", disabled=len(pages) == 1, use_container_width=True):
+                pages.pop()
+                st.rerun()
+            p_col2.caption(f"Strona {len(pages)}")
+            if p_col3.button("Następna ➡️", disabled=not has_more, use_container_width=True):
+                pages.append(rows[-1].id)
+                st.rerun()
+
             st.divider()
             st.write("### ⚠️ Administracja statystykami")
-            num_q = len(filtered_questions)
             
-            if st.button(f"Zresetuj statystyki dla {num_q} pytań", type="secondary"):
+            if st.button("Zresetuj statystyki dla pytań spełniających filtry", type="secondary"):
                 st.session_state.confirm_reset = True
 
             if st.session_state.get("confirm_reset", False):
-                st.warning(f"Czy na pewno wyzerować dane dla kategorii '{selected_type_name}'?")
+                num_q = count_questions(**filters)
+                st.warning(f"Czy na pewno wyzerować dane dla {num_q} pytań (kategoria '{selected_type_name}')?")
                 c1, c2 = st.columns(2)
                 if c1.button("TAK, RESETUJ", type="primary", use_container_width=True):
-                    for q in filtered_questions:
-                        q.total_attempts = 0
-                        q.correct_attempts = 0
-                        q.pass_rate = 0.0
-                    session.commit()
+                    reset_questions_stats(**filters)
                     st.session_state.confirm_reset = False
                     st.success("Zresetowano pomyślnie.")
                     st.rerun()
@@ -222,7 +332,7 @@ def show_editor_ui():
                     st.session_state.confirm_reset = False
                     st.rerun()
         else:
-            st.info("Brak pytań w tej kategorii.")
+            st.info("Brak pytań spełniających kryteria.")
 
     # --- LOGIKA: MASOWY IMPORT ---
     elif choice == "🚀 Masowy Import":
@@ -237,11 +347,53 @@ def show_editor_ui():
         
         if st.button("URUCHOM IMPORT", type="primary", use_container_width=True):
             if excel_file and zip_file:
-                with st.spinner("Przetwarzanie danych..."):
-                    summary = run_mass_import(excel_file, zip_file, session)
-                    st.success(f"Import zakończony! Sukcesy: {summary['success']}, Błędy: {summary['errors']}")
-                    st.rerun()
+                start_import_job(excel_file, zip_file, st.session_state.user.id)
+                st.toast("Import uruchomiony w tle.")
             else:
                 st.error("Wymagane oba pliki do poprawnego importu!")
 
+        # Postęp ostatniego importu - zadanie działa w tle, także po przejściu na inną stronę
+        show_import_progress(st.session_state.user.id)
+
+    # --- LOGIKA: EKSPORT ---
+    elif choice == "📤 Eksport":
+        st.subheader("📤 Eksport bazy (XLSX + ZIP)")
+        st.info("Pliki w formacie masowego importu - do przeniesienia pytań na inną instancję.")
+        type_names = ["Wszystkie"] + [t.name for t in all_test_types]
+        selected_type_name = st.selectbox("Rodzaj testu:", type_names)
+
+        st.caption("Przy bardzo dużej bazie grafik (paczka rzędu GB) lepiej użyć eksportu z linii poleceń: "
+                   "`docker exec testy python exporter.py /tmp/pytania.xlsx /tmp/grafiki.zip`.")
+
+        if st.button("PRZYGOTUJ EKSPORT", type="primary", use_container_width=True):
+            test_type_id = type_options[selected_type_name].id if selected_type_name != "Wszystkie" else None
+            remove_stale_exports()
+            export_dir = tempfile.mkdtemp(prefix=EXPORT_PREFIX)
+            xlsx_path = os.path.join(export_dir, "pytania.xlsx")
+            zip_path = os.path.join(export_dir, "grafiki.zip")
+            try:
+                with st.spinner("Eksportowanie pytań..."):
+                    result = export_questions(xlsx_path, zip_path, test_type_id=test_type_id)
+            except Exception:
+                shutil.rmtree(export_dir, ignore_errors=True)
+                raise
+            # W sesji tylko ścieżki - treść plików czytana jest dopiero przy pobieraniu
+            st.session_state.export_files = {"pytania.xlsx": xlsx_path, "grafiki.zip": zip_path}
+            st.success(f"Wyeksportowano {result['questions']} pytań i {result['images']} grafik.")
+            if result["missing_images"]:
+                st.warning(f"Brakujące pliki grafik: {result['missing_images']} (pominięte w paczce).")
+
+        export_files = st.session_state.get("export_files")
+        if export_files:
+            c1, c2 = st.columns(2)
+            downloads = [
+                (c1, "pytania.xlsx", "📥 Pobierz pytania (XLSX)", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+                (c2, "grafiki.zip", "📥 Pobierz grafiki (ZIP)", "application/zip"),
+            ]
+            for col, file_name, label, mime in downloads:
+                path = export_files.get(file_name)
+                if path and os.path.exists(path):
+                    col.download_button(label, export_download(path), file_name=file_name, mime=mime,
+                                        on_click=forget_export_file, args=(file_name,))
+
     session.close()
\ No newline at end of file
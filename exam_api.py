@@ -0,0 +1,272 @@
+import re
+import json
+import time
+import hmac
+import base64
+import hashlib
+import secrets
+from datetime import datetime
+from wsgiref.simple_server import make_server
+import config
+import manager
+import obrazy
+from db import (get_session, get_professions, get_test_types, get_exam_questions, save_exam_attempt,
+                user_profession_m2m, ExamAttempt)
+
+# Bezstanowe API egzaminów: cały stan (użytkownik, wylosowane pytania) jest w podpisanych tokenach,
+# więc dowolny proces/replika obsłuży dowolne żądanie. Edycja bazy i administracja zostają w Streamlit.
+
+LABELS = ("A", "B", "C")
+PASS_PERCENT = 90
+MAX_BODY_BYTES = 64 * 1024
+
+if config.API_SECRET:
+    _secret = config.API_SECRET.encode("utf-8")
+else:
+    # Przy gunicorn --preload losowy klucz jest wspólny dla procesów jednej instancji, ale nie dla replik
+    _secret = secrets.token_bytes(32)
+    print("API egzaminów: brak API_SECRET - tokeny ważne tylko do restartu tej instancji")
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# --- TOKENY ---
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def sign_token(payload):
+    """Token '<dane>.<podpis>' (HMAC-SHA256), dane w JSON - czytelne, ale niemożliwe do podrobienia."""
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    signature = _b64(hmac.new(_secret, body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{signature}"
+
+def verify_token(token, kind):
+    """Zwraca dane tokenu danego rodzaju ('auth'/'exam') albo zgłasza ApiError 401."""
+    try:
+        body, signature = token.split(".")
+        expected = _b64(hmac.new(_secret, body.encode("ascii"), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            raise ValueError("podpis")
+        payload = json.loads(_unb64(body))
+    except (ValueError, AttributeError):
+        raise ApiError(401, "Nieprawidłowy token.")
+    if payload.get("typ") != kind or payload.get("exp", 0) < time.time():
+        raise ApiError(401, "Token wygasł lub jest nieprawidłowy.")
+    return payload
+
+# --- POMOCNICZE ---
+
+def client_ip(environ):
+    return manager.client_address(environ.get("HTTP_X_FORWARDED_FOR"), environ.get("REMOTE_ADDR"))
+
+def read_json(environ):
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, "Zbyt duże żądanie.")
+    try:
+        data = json.loads(environ["wsgi.input"].read(length) or b"{}")
+    except ValueError:
+        raise ApiError(400, "Niepoprawny JSON.")
+    if not isinstance(data, dict):
+        raise ApiError(400, "Oczekiwano obiektu JSON.")
+    return data
+
+def current_user(environ):
+    header = environ.get("HTTP_AUTHORIZATION", "")
+    if not header.startswith("Bearer "):
+        raise ApiError(401, "Wymagane logowanie (nagłówek Authorization: Bearer <token>).")
+    return verify_token(header[len("Bearer "):].strip(), "auth")
+
+def exam_for(user, exam_token):
+    exam = verify_token(exam_token, "exam")
+    if exam["uid"] != user["uid"]:
+        raise ApiError(403, "Egzamin należy do innego użytkownika.")
+    return exam
+
+def allowed_profession_ids(user):
+    """Grupy zawodowe, z których użytkownik może rozwiązywać testy (jak w Streamlit)."""
+    if user["role"] != config.ROLE_USER:
+        return {p.id for p in get_professions()}
+    session = get_session()
+    try:
+        rows = session.query(user_profession_m2m.c.profession_id).filter(
+            user_profession_m2m.c.user_id == user["uid"])
+        return {r[0] for r in rows}
+    finally:
+        session.close()
+
+def attempt_exists(nonce):
+    session = get_session()
+    try:
+        return session.query(ExamAttempt.id).filter(ExamAttempt.exam_nonce == nonce).first() is not None
+    finally:
+        session.close()
+
+# --- ENDPOINTY ---
+
+def login(environ, data):
+    username = str(data.get("username", ""))
+    password = str(data.get("password", ""))
+    # TimeoutError z przepełnionej puli bcrypt przechodzi dalej - app() odpowiada 503, nie 401
+    try:
+        user = manager.authenticate_user(username, password, ip=client_ip(environ))
+    except manager.LoginLocked as e:
+        raise ApiError(429, str(e))
+    if not user:
+        raise ApiError(401, "Nieprawidłowy login lub hasło.")
+    token = sign_token({"typ": "auth", "uid": user.id, "role": user.role,
+                        "exp": int(time.time()) + config.API_TOKEN_TTL})
+    return {"token": token, "expires_in": config.API_TOKEN_TTL, "username": user.username, "role": user.role}
+
+def options(environ, data):
+    user = current_user(environ)
+    allowed = allowed_profession_ids(user)
+    return {
+        "professions": [{"id": p.id, "name": p.name} for p in get_professions() if p.id in allowed],
+        "test_types": [{"id": t.id, "name": t.name} for t in get_test_types()],
+    }
+
+def start_exam(environ, data):
+    user = current_user(environ)
+    try:
+        profession_id = int(data["profession_id"])
+        test_type_id = int(data["test_type_id"])
+    except (KeyError, TypeError, ValueError):
+        raise ApiError(400, "Wymagane pola: profession_id, test_type_id.")
+    if profession_id not in allowed_profession_ids(user):
+        raise ApiError(403, "Brak uprawnień do tej grupy zawodowej.")
+
+    ids = manager.draw_exam_ids(profession_id, test_type_id)
+    if not ids:
+        raise ApiError(404, "Brak pytań dla wybranej konfiguracji.")
+    started = int(time.time())
+    # nonce identyfikuje egzamin w historii podejść (unikalny klucz) - jedna ocena na token
+    token = sign_token({"typ": "exam", "uid": user["uid"], "pid": profession_id, "tid": test_type_id,
+                        "ids": ids, "nonce": secrets.token_urlsafe(16), "iat": started,
+                        "exp": started + config.API_EXAM_TTL})
+    return {"exam_token": token, "count": len(ids), "expires_in": config.API_EXAM_TTL}
+
+def get_question(environ, data, exam_token, number):
+    exam = exam_for(current_user(environ), exam_token)
+    n = int(number)
+    if not 1 <= n <= len(exam["ids"]):
+        raise ApiError(404, "Nie ma pytania o takim numerze.")
+    q = get_exam_questions([exam["ids"][n - 1]]).get(exam["ids"][n - 1])
+    if q is None:
+        raise ApiError(410, "Pytanie zostało usunięte z bazy.")
+    # Bez poprawnej odpowiedzi i komentarza - te trafiają do klienta dopiero po ocenie
+    return {
+        "n": n,
+        "count": len(exam["ids"]),
+        "content": q.content,
+        "image": obrazy.image_url(q.image_path, "display"),
+        "answers": [{"label": label, "text": text or "", "image": obrazy.image_url(img, "display")}
+                    for label, text, img in zip(LABELS, (q.ans_a, q.ans_b, q.ans_c), (q.image_a, q.image_b, q.image_c))],
+    }
+
+def submit_exam(environ, data, exam_token):
+    user = current_user(environ)
+    exam = exam_for(user, exam_token)
+    answers = data.get("answers")
+    if not isinstance(answers, list) or len(answers) != len(exam["ids"]) \
+            or any(a is not None and a not in LABELS for a in answers):
+        raise ApiError(400, f"Pole answers: lista {len(exam['ids'])} wartości 'A', 'B', 'C' lub null.")
+
+    started_at = datetime.fromtimestamp(exam["iat"])
+    # Token egzaminu jest bezstanowy - ponowne wysłanie rozpoznajemy po zapisanym podejściu
+    if attempt_exists(exam["nonce"]):
+        raise ApiError(409, "Ten egzamin został już oceniony.")
+
+    questions = get_exam_questions(exam["ids"])
+    results = []
+    for n, (q_id, chosen) in enumerate(zip(exam["ids"], answers), start=1):
+        q = questions.get(q_id)
+        if q is None:
+            continue  # Pytanie usunięte w trakcie egzaminu nie jest oceniane
+        results.append({"n": n, "question_id": q_id, "chosen": chosen, "correct_ans": q.correct_ans,
+                        "is_correct": chosen == q.correct_ans, "comment": q.comment})
+
+    attempt_id = save_exam_attempt(user["uid"], exam["pid"], exam["tid"],
+                                   [(r["question_id"], r["chosen"], r["is_correct"]) for r in results],
+                                   started_at=started_at, exam_nonce=exam["nonce"])
+    if attempt_id is None:
+        # Równoległe wysłanie: drugi zapis odrzucił unikalny klucz exam_nonce (razem ze statystykami)
+        if attempt_exists(exam["nonce"]):
+            raise ApiError(409, "Ten egzamin został już oceniony.")
+        raise ApiError(500, "Nie udało się zapisać wyniku.")
+    score = sum(1 for r in results if r["is_correct"])
+    percent = round(score / len(results) * 100, 2) if results else 0.0
+    return {"attempt_id": attempt_id, "score": score, "total": len(results), "percent": percent,
+            "passed": percent >= PASS_PERCENT, "results": results}
+
+def health(environ, data):
+    return {"status": "ok"}
+
+# (metoda, wzorzec ścieżki, funkcja) - grupy wzorca trafiają do funkcji jako argumenty
+ROUTES = [
+    ("GET", r"/api/health", health),
+    ("POST", r"/api/login", login),
+    ("GET", r"/api/options", options),
+    ("POST", r"/api/exams", start_exam),
+    ("GET", r"/api/exams/([\w.-]+)/questions/(\d+)", get_question),
+    ("POST", r"/api/exams/([\w.-]+)/submit", submit_exam),
+]
+_compiled_routes = [(method, re.compile(pattern + r"/?"), handler) for method, pattern, handler in ROUTES]
+
+def resolve_route(method, path):
+    """(funkcja, dopasowanie) dla żądania; 404 dla nieznanej ścieżki, 405 dla złej metody."""
+    path_known = False
+    for route_method, regex, handler in _compiled_routes:
+        match = regex.fullmatch(path)
+        if match:
+            if route_method == method:
+                return handler, match
+            path_known = True
+    if path_known:
+        raise ApiError(405, "Niedozwolona metoda.")
+    raise ApiError(404, "Nieznany adres.")
+
+STATUS_TEXT = {200: "200 OK", 400: "400 Bad Request", 401: "401 Unauthorized", 403: "403 Forbidden",
+               404: "404 Not Found", 405: "405 Method Not Allowed", 409: "409 Conflict", 410: "410 Gone",
+               413: "413 Payload Too Large", 429: "429 Too Many Requests", 500: "500 Internal Server Error",
+               503: "503 Service Unavailable"}
+
+def app(environ, start_response):
+    """Aplikacja WSGI (gunicorn -c gunicorn.conf.py exam_api:app)."""
+    method = environ.get("REQUEST_METHOD", "GET")
+    path = environ.get("PATH_INFO", "")
+    status, body = 200, None
+    try:
+        handler, match = resolve_route(method, path)
+        data = read_json(environ) if method == "POST" else {}
+        body = handler(environ, data, *match.groups())
+    except ApiError as e:
+        status, body = e.status, {"error": e.message}
+    except TimeoutError:
+        status, body = 503, {"error": "Serwer jest przeciążony, spróbuj ponownie za chwilę."}
+    except Exception as e:
+        print(f"Błąd API ({method} {path}): {e}")
+        status, body = 500, {"error": "Błąd serwera."}
+
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    start_response(STATUS_TEXT.get(status, f"{status} Error"), [
+        ("Content-Type", "application/json; charset=utf-8"),
+        ("Content-Length", str(len(payload))),
+        ("Cache-Control", "no-store"),
+    ])
+    return [payload]
+
+if __name__ == "__main__":
+    # Użycie: python exam_api.py  - serwer deweloperski (jeden proces); produkcyjnie gunicorn
+    print(f"API egzaminów: http://0.0.0.0:{config.API_PORT}/api/health")
+    make_server("0.0.0.0", config.API_PORT, app).serve_forever()
@@ -0,0 +1,67 @@
+import os
+import base64
+import streamlit.components.v1 as components
+import obrazy
+
+# Komponent bez procesu budowania (czysty HTML + JS) - Streamlit serwuje katalog jako statyczne pliki
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "exam_client")
+_component = components.declare_component("exam_client", path=_FRONTEND_DIR)
+
+MIME_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png"}
+LABELS = ("A", "B", "C")
+
+def image_src(image_path):
+    """
+    Adres grafiki dla przeglądarki: wersjonowany URL serwera grafik (MEDIA_BASE_URL),
+    a bez serwera - wersja ekranowa osadzona jako data URI (większy pakiet, ale nadal jeden).
+    """
+    if not image_path:
+        return None
+    url = obrazy.image_url(image_path, "display")
+    if url:
+        return url
+    path = obrazy.variant_path(image_path, "display")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    mime = MIME_TYPES.get(path.rsplit(".", 1)[-1].lower(), "application/octet-stream")
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def build_payload(questions):
+    """Pakiet pytań egzaminu dla przeglądarki - treść i grafiki, bez poprawnych odpowiedzi."""
+    payload = []
+    for q in questions:
+        payload.append({
+            "content": q.content,
+            "image": image_src(q.image_path),
+            "answers": [
+                {"label": label, "text": text or "", "image": image_src(img)}
+                for label, text, img in zip(LABELS, (q.ans_a, q.ans_b, q.ans_c), (q.image_a, q.image_b, q.image_c))
+            ],
+        })
+    return payload
+
+def parse_answers(value, count):
+    """
+    Sprawdza wektor odpowiedzi odesłany przez przeglądarkę.
+    Zwraca {indeks: 'A'|'B'|'C'} (pominięte pozycje nie trafiają do słownika) albo None,
+    gdy odpowiedzi jeszcze nie wysłano lub mają niepoprawny format.
+    """
+    if not isinstance(value, dict) or not value.get("submitted"):
+        return None
+    answers = value.get("answers")
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    if any(a is not None and a not in LABELS for a in answers):
+        return None
+    return {i: a for i, a in enumerate(answers) if a is not None}
+
+def exam_client(exam_id, questions, key=None):
+    """
+    Rysuje cały egzamin w przeglądarce. Zwraca None do chwili zakończenia testu,
+    potem {"submitted": True, "answers": [...]} - jeden komunikat na cały egzamin.
+    exam_id rozróżnia egzaminy (postęp w przeglądarce jest zapamiętywany per egzamin).
+    """
+    return _component(exam_id=exam_id, questions=build_payload(questions), key=key, default=None)
@@ -0,0 +1,261 @@
+import json
+import sqlite3
+import threading
+import time
+import atexit
+from collections import namedtuple
+from datetime import datetime, timedelta
+import config
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from db import get_session, ExamProgress
+
+# Stan trwającego egzaminu. answers: lista na pozycjach jak question_ids ("A"/"B"/"C" lub None)
+Progress = namedtuple('Progress', ['user_id', 'seq', 'profession_id', 'test_type_id', 'question_ids', 'answers',
+                                   'current_idx', 'phase', 'started_at', 'updated_at'])
+
+# --- MAGAZYNY ---
+
+class ProgressStore:
+    """Interfejs magazynu postępu: jeden trwający egzamin na użytkownika."""
+
+    def load(self, user_id):
+        """Zwraca Progress lub None."""
+        raise NotImplementedError
+
+    def save(self, progress):
+        """
+        Zapisuje stan. Nowy egzamin (seq == 0) zastępuje poprzedni; kolejne zapisy aktualizują
+        tylko ten sam egzamin (started_at) o niższym seq - spóźniony zapis z innej repliki
+        nie nadpisze nowszego stanu ani nie wskrzesi postępu usuniętego po zakończeniu testu.
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+class NullProgressStore(ProgressStore):
+    """Wznawianie wyłączone (EXAM_PROGRESS_STORE=none)."""
+
+    def load(self, user_id):
+        return None
+
+    def save(self, progress):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+class DbProgressStore(ProgressStore):
+    """Tabela exam_progress w bazie aplikacji - wspólna dla wszystkich replik."""
+
+    def load(self, user_id):
+        session = get_session()
+        try:
+            row = session.get(ExamProgress, user_id)
+            if row is None:
+                return None
+            return Progress(row.user_id, row.seq, row.profession_id, row.test_type_id,
+                            json.loads(row.question_ids), json.loads(row.answers),
+                            row.current_idx, row.phase, row.started_at, row.updated_at)
+        finally:
+            session.close()
+
+    def save(self, progress):
+        values = {
+            "seq": progress.seq,
+            "profession_id": progress.profession_id,
+            "test_type_id": progress.test_type_id,
+            "question_ids": json.dumps(progress.question_ids),
+            "answers": json.dumps(progress.answers),
+            "current_idx": progress.current_idx,
+            "phase": progress.phase,
+            "started_at": progress.started_at,
+            "updated_at": progress.updated_at,
+        }
+        table = ExamProgress.__table__
+        session = get_session()
+        try:
+            if progress.seq == 0:
+                # Upsert: nadpisanie wiersza użytkownika, a gdy go nie ma - INSERT
+                updated = session.execute(update(table).where(table.c.user_id == progress.user_id).values(**values))
+                if updated.rowcount == 0:
+                    try:
+                        session.execute(insert(table).values(user_id=progress.user_id, **values))
+                    except IntegrityError:
+                        # Równoległy INSERT z innej repliki - nowy egzamin i tak ma wygrać
+                        session.rollback()
+                        session.execute(update(table).where(table.c.user_id == progress.user_id).values(**values))
+            else:
+                # Jedno warunkowe UPDATE - porównanie seq/started_at wykonuje baza, bez wyścigu odczyt-zapis
+                session.execute(update(table).where(
+                    table.c.user_id == progress.user_id,
+                    table.c.started_at == progress.started_at,
+                    table.c.seq < progress.seq
+                ).values(**values))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Błąd zapisu postępu egzaminu: {e}")
+        finally:
+            session.close()
+
+    def delete(self, user_id):
+        session = get_session()
+        try:
+            session.query(ExamProgress).filter(ExamProgress.user_id == user_id).delete()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Błąd usuwania postępu egzaminu: {e}")
+        finally:
+            session.close()
+
+class SqliteProgressStore(ProgressStore):
+    """Lokalny plik SQLite - zastępstwo bazy dla pojedynczej instancji (np. środowisko testowe)."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS exam_progress ("
+                         "user_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL, started_at TEXT, data TEXT NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, user_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM exam_progress WHERE user_id = ?", (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        for key in ("started_at", "updated_at"):
+            if data[key]:
+                data[key] = datetime.fromisoformat(data[key])
+        return Progress(**data)
+
+    def save(self, progress):
+        data = progress._asdict()
+        for key in ("started_at", "updated_at"):
+            if data[key]:
+                data[key] = data[key].isoformat()
+        conn = self._connect()
+        try:
+            with conn:
+                if progress.seq == 0:
+                    conn.execute("INSERT OR REPLACE INTO exam_progress (user_id, seq, started_at, data) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 (progress.user_id, progress.seq, data["started_at"], json.dumps(data)))
+                else:
+                    conn.execute("UPDATE exam_progress SET seq = ?, data = ? "
+                                 "WHERE user_id = ? AND started_at IS ? AND seq < ?",
+                                 (progress.seq, json.dumps(data), progress.user_id, data["started_at"], progress.seq))
+        finally:
+            conn.close()
+
+    def delete(self, user_id):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM exam_progress WHERE user_id = ?", (user_id,))
+        finally:
+            conn.close()
+
+def create_store(kind=None):
+    """Magazyn wybrany w konfiguracji (EXAM_PROGRESS_STORE)."""
+    kind = kind or config.EXAM_PROGRESS_STORE
+    if kind == "db":
+        return DbProgressStore()
+    if kind == "sqlite":
+        return SqliteProgressStore(config.EXAM_PROGRESS_SQLITE_PATH)
+    return NullProgressStore()
+
+# --- SCALANIE ZAPISÓW ---
+
+class CoalescingWriter:
+    """
+    Zbiera zmiany postępu i zapisuje do magazynu w tle, najwyżej raz na flush_seconds.
+    Kilka kliknięć w tym czasie daje jeden zapis (ostatni stan wygrywa).
+    """
+
+    def __init__(self, store, flush_seconds):
+        self.store = store
+        self.flush_seconds = flush_seconds
+        self._pending = {}  # user_id -> Progress
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, progress):
+        with self._lock:
+            self._pending[progress.user_id] = progress
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="exam-progress-writer", daemon=True)
+                self._thread.start()
+
+    def discard(self, user_id):
+        """Porzuca oczekujący zapis (np. po zakończeniu egzaminu)."""
+        with self._lock:
+            self._pending.pop(user_id, None)
+
+    def flush(self, user_id=None):
+        """Zapisuje oczekujące zmiany wszystkich użytkowników lub tylko wskazanego."""
+        with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, {}
+            else:
+                pending = self._pending.pop(user_id, None)
+                batch = {user_id: pending} if pending else {}
+        for progress in batch.values():
+            try:
+                self.store.save(progress)
+            except Exception as e:
+                print(f"Błąd zapisu postępu egzaminu: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+_writer = None
+_init_lock = threading.Lock()
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _init_lock:
+            if _writer is None:
+                _writer = CoalescingWriter(create_store(), config.EXAM_PROGRESS_FLUSH_SECONDS)
+                atexit.register(_writer.flush)  # Oczekujące zmiany przy zatrzymaniu kontenera
+    return _writer
+
+# --- API DLA test.py ---
+
+def save(progress, immediate=False):
+    """Zapis postępu: domyślnie scalany w tle, immediate=True - od razu (start egzaminu)."""
+    writer = _get_writer()
+    if immediate:
+        writer.discard(progress.user_id)
+        writer.store.save(progress)
+    else:
+        writer.submit(progress)
+
+def load(user_id):
+    """Niedokończony egzamin użytkownika (nie starszy niż EXAM_PROGRESS_MAX_AGE_HOURS) lub None."""
+    writer = _get_writer()
+    writer.flush(user_id)  # Niezapisane jeszcze zmiany z tej repliki
+    progress = writer.store.load(user_id)
+    if progress is None:
+        return None
+    if progress.updated_at < datetime.now() - timedelta(hours=config.EXAM_PROGRESS_MAX_AGE_HOURS):
+        writer.store.delete(user_id)
+        return None
+    return progress
+
+def clear(user_id):
+    """Usuwa postęp po zakończeniu lub porzuceniu egzaminu."""
+    writer = _get_writer()
+    writer.discard(user_id)
+    writer.store.delete(user_id)
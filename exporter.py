@@ -0,0 +1,114 @@
+import os
+import sys
+import zipfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from db import (get_session, Question, ProfessionGroup, TestType, question_profession_m2m, question_test_type_m2m,
+                question_filters)
+
+# Kolumny w formacie czytanym przez importer.run_mass_import
+COLUMNS = ['Tresc', 'Odp_A', 'Odp_B', 'Odp_C', 'Poprawna',
+           'Grafika_Glowna', 'Grafika_A', 'Grafika_B', 'Grafika_C', 'Rodzaje', 'Grupy', 'Komentarz']
+BATCH_SIZE = 1000  # Liczba pytań pobieranych z kursora na raz
+
+def _text_cell(ws, value):
+    """Komórka tekstowa - bez znaków niedozwolonych w XLSX i bez interpretacji '=' jako formuły."""
+    if value is None:
+        return None
+    cell = WriteOnlyCell(ws, value=ILLEGAL_CHARACTERS_RE.sub('', str(value)))
+    cell.data_type = 's'
+    return cell
+
+def _names_for(session, link_table, link_col, model, question_ids):
+    """ID pytania -> 'Nazwa1, Nazwa2' dla porcji pytań (jedno zapytanie)."""
+    rows = session.query(link_table.c.question_id, model.name).join(
+        model, model.id == link_col
+    ).filter(link_table.c.question_id.in_(question_ids)).order_by(model.name)
+    names = {}
+    for q_id, name in rows:
+        names.setdefault(q_id, []).append(name)
+    return {q_id: ", ".join(n) for q_id, n in names.items()}
+
+def _batches(query):
+    batch = []
+    for row in query:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def export_questions(xlsx_out, zip_out, **filters):
+    """
+    Eksport bazy pytań do pary plików XLSX + ZIP zgodnej z masowym importem.
+    Pytania czytane są kursorem po stronie serwera (porcjami), arkusz zapisywany
+    w trybie write-only, a grafiki strumieniowo dopisywane do ZIP - zużycie pamięci
+    nie zależy od wielkości bazy. filters: jak w db.list_questions (np. test_type_id).
+    xlsx_out / zip_out: ścieżki lub obiekty plikowe. Zwraca podsumowanie.
+    """
+    summary = {"questions": 0, "images": 0, "missing_images": 0}
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Pytania")
+    ws.append(COLUMNS)
+
+    stream_session = get_session()  # Kursor strumieniowy (zajmuje połączenie do końca odczytu)
+    lookup_session = get_session()  # Osobne połączenie na nazwy rodzajów i grup
+    try:
+        query = stream_session.query(
+            Question.id, Question.content, Question.ans_a, Question.ans_b, Question.ans_c, Question.correct_ans,
+            Question.image_path, Question.image_a, Question.image_b, Question.image_c, Question.comment
+        ).filter(*question_filters(**filters)).order_by(Question.id).execution_options(
+            stream_results=True, yield_per=BATCH_SIZE)
+
+        with zipfile.ZipFile(zip_out, 'w', zipfile.ZIP_STORED) as z:
+            written = {}  # ścieżka na dysku -> nazwa w paczce
+            arcnames = set()
+
+            def add_image(path):
+                """Dopisuje grafikę do ZIP (raz na plik) i zwraca jej nazwę w paczce."""
+                if not path:
+                    return None
+                if path in written:
+                    return written[path]
+                if not os.path.exists(path):
+                    summary["missing_images"] += 1
+                    return None
+                arcname = os.path.basename(path)
+                if arcname in arcnames:
+                    arcname = f"{len(written)}_{arcname}"  # Ta sama nazwa w różnych katalogach
+                z.write(path, arcname)  # Kopiowanie porcjami, bez wczytywania całego pliku
+                written[path] = arcname
+                arcnames.add(arcname)
+                summary["images"] += 1
+                return arcname
+
+            for batch in _batches(query):
+                ids = [r.id for r in batch]
+                types = _names_for(lookup_session, question_test_type_m2m,
+                                   question_test_type_m2m.c.test_type_id, TestType, ids)
+                profs = _names_for(lookup_session, question_profession_m2m,
+                                   question_profession_m2m.c.profession_id, ProfessionGroup, ids)
+                for r in batch:
+                    ws.append([
+                        _text_cell(ws, r.content), _text_cell(ws, r.ans_a), _text_cell(ws, r.ans_b),
+                        _text_cell(ws, r.ans_c), r.correct_ans,
+                        add_image(r.image_path), add_image(r.image_a), add_image(r.image_b), add_image(r.image_c),
+                        _text_cell(ws, types.get(r.id)), _text_cell(ws, profs.get(r.id)), _text_cell(ws, r.comment)
+                    ])
+                    summary["questions"] += 1
+    finally:
+        stream_session.close()
+        lookup_session.close()
+
+    wb.save(xlsx_out)
+    return summary
+
+if __name__ == "__main__":
+    # Użycie: python exporter.py pytania.xlsx grafiki.zip
+    xlsx_path = sys.argv[1] if len(sys.argv) > 1 else "pytania.xlsx"
+    zip_path = sys.argv[2] if len(sys.argv) > 2 else "grafiki.zip"
+    result = export_questions(xlsx_path, zip_path)
+    print(f"Eksport: pytania {result['questions']}, grafiki {result['images']}, brakujące pliki {result['missing_images']}")
@@ -0,0 +1,13 @@
+# Konfiguracja gunicorna dla API egzaminów: gunicorn -c gunicorn.conf.py exam_api:app
+# (nie importujemy modułu config pod tą nazwą - gunicorn traktuje zmienne tego pliku jako swoje ustawienia)
+from config import API_PORT, API_WORKERS
+
+bind = f"0.0.0.0:{API_PORT}"
+workers = API_WORKERS  # Proces na rdzeń - API nie trzyma stanu, więc skaluje się też replikami
+preload_app = True  # Kod (i ewentualny losowy API_SECRET) ładowany raz, przed rozwidleniem procesów
+accesslog = "-"
+
+def post_fork(server, worker):
+    # Połączenia z puli nie mogą być współdzielone między procesami - każdy worker otwiera własne
+    import db
+    db.engine.dispose(close=False)
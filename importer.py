@@ -2,75 +2,369 @@ import pandas as pd
 import zipfile
 import io
 import os
+from sqlalchemy import insert, func, or_, and_
 from sqlalchemy.orm import Session
-from db import Question, ProfessionGroup, TestType
+from db import (get_session, Question, ProfessionGroup, TestType, ImportJob, question_profession_m2m,
+                question_test_type_m2m, invalidate_question_pool, invalidate_reference_cache)
 import shutil
+import json
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import obrazy
+import config
 
 UPLOAD_FOLDER = "uploads"
+IMAGE_COLUMNS = ['Grafika_Glowna', 'Grafika_A', 'Grafika_B', 'Grafika_C']
 
-def run_mass_import(excel_file, zip_file, session: Session):
+def split_names(value):
+    """Komórka 'Rodzaje'/'Grupy' -> lista nazw (rozdzielone przecinkami)."""
+    if not pd.notna(value):
+        return []
+    return list(dict.fromkeys(n.strip() for n in str(value).split(',') if n.strip()))
+
+def resolve_categories(session, model, names):
+    """
+    Zwraca słownik nazwa -> ID dla wszystkich nazw jednym zapytaniem;
+    brakujące pozycje są tworzone (jeden zbiorczy INSERT).
+    Nazwy porównywane są bez rozróżniania wielkości liter, jak w MariaDB (collation *_ci) -
+    'ruchowe' z arkusza trafia do istniejącej kategorii 'Ruchowe' zamiast łamać klucz unikalny.
+    """
+    if not names:
+        return {}
+    keys = {n.casefold() for n in names}
+
+    def lookup(wanted):
+        rows = session.query(model.name, model.id).filter(func.lower(model.name).in_([k.lower() for k in wanted]))
+        return {name.casefold(): id_ for name, id_ in rows}
+
+    found = lookup(keys)
+    # Jedna nowa pozycja na klucz - w pisowni z pierwszego wystąpienia w arkuszu
+    missing = {}
+    for n in names:
+        if n.casefold() not in found:
+            missing.setdefault(n.casefold(), n)
+    if missing:
+        session.execute(insert(model.__table__), [{"name": n} for n in missing.values()])
+        found.update(lookup(missing))
+    return {n: found[n.casefold()] for n in names}
+
+def check_zip_members(z, names):
+    """
+    Sprawdza grafiki wskazane w arkuszu, zanim cokolwiek trafi na dysk lub do bazy.
+    Zwraca słownik nazwa -> opis problemu (brak w paczce, zły typ, za duży plik).
     """
-    excel_file: Obiekt file-like (Streamlit UploadedFile)
-    zip_file: Obiekt file-like (Streamlit UploadedFile)
+    max_bytes = config.IMPORT_MAX_IMAGE_MB * 1024 * 1024
+    problems = {}
+    for name in names:
+        if name.rsplit('.', 1)[-1].lower() not in config.ALLOWED_EXTENSIONS:
+            problems[name] = f"Niedozwolony typ pliku: {name}"
+            continue
+        try:
+            info = z.getinfo(name)
+        except KeyError:
+            problems[name] = f"Brak pliku w paczce ZIP: {name}"
+            continue
+        if info.file_size > max_bytes:
+            problems[name] = f"Plik {name} przekracza {config.IMPORT_MAX_IMAGE_MB} MB"
+    return problems
+
+def extract_images(z, names):
+    """
+    Strumieniowo zapisuje do magazynu tylko wskazane grafiki (porcjami, bez extractall),
+    równolegle w puli wątków. Zwraca (nazwa -> ścieżka, nazwa -> błąd).
+    Nazwy z paczki nie stają się ścieżkami na dysku - plik trafia pod adres z hasha treści.
+    """
+    def store(name):
+        # Sprawdzenie przed umieszczeniem w magazynie - odrzucony plik nie zostaje w uploads/
+        with z.open(name) as member:
+            return obrazy.store_file(member, name.rsplit('.', 1)[-1], validate=True)
+
+    stored, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=config.IMPORT_WORKERS) as pool:
+        futures = {name: pool.submit(store, name) for name in names}
+        for name, future in futures.items():
+            try:
+                stored[name] = future.result()
+            except Exception as e:
+                failed[name] = f"Nie udało się odczytać {name}: {e}"
+    return stored, failed
+
+def insert_chunk(session, chunk):
     """
+    Zapisuje porcję pytań zbiorczym INSERT (Core) wraz z powiązaniami M2M.
+    chunk: lista (nr_wiersza, dane_pytania, ID_rodzajów, ID_grup).
+    """
+    ids = session.execute(
+        insert(Question.__table__).returning(Question.__table__.c.id, sort_by_parameter_order=True),
+        [data for _, data, _, _ in chunk]
+    ).scalars().all()
+
+    type_links = [{"question_id": q_id, "test_type_id": t_id}
+                  for q_id, (_, _, type_ids, _) in zip(ids, chunk) for t_id in type_ids]
+    prof_links = [{"question_id": q_id, "profession_id": p_id}
+                  for q_id, (_, _, _, prof_ids) in zip(ids, chunk) for p_id in prof_ids]
+    if type_links:
+        session.execute(insert(question_test_type_m2m), type_links)
+    if prof_links:
+        session.execute(insert(question_profession_m2m), prof_links)
+
+def run_mass_import(excel_file, zip_file, session: Session, chunk_size=None, progress=None):
+    """
+    excel_file: Obiekt file-like (Streamlit UploadedFile) lub ścieżka
+    zip_file: Obiekt file-like (Streamlit UploadedFile) lub ścieżka
+    Pytania zapisywane są porcjami po chunk_size (domyślnie config.IMPORT_CHUNK_SIZE),
+    każda porcja w osobnej transakcji. Zwraca podsumowanie z listą błędów
+    (numer wiersza w Excelu, opis).
+    progress: opcjonalna funkcja progress(summary, total_rows) wołana po każdym etapie/porcji.
+    """
+    chunk_size = chunk_size or config.IMPORT_CHUNK_SIZE
+
     # 1. Odczyt Excela
     df = pd.read_excel(excel_file)
-    
-    # 2. Obsługa ZIP (rozpakowanie grafik)
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
-        
-    with zipfile.ZipFile(zip_file, 'r') as z:
-        z.extractall(UPLOAD_FOLDER)
+    records = df.to_dict('records')
 
-    summary = {"success": 0, "errors": 0}
+    def report():
+        if progress:
+            progress(summary, len(records))
 
-    for _, row in df.iterrows():
+    summary = {"success": 0, "errors": 0, "error_rows": []}
+
+    def row_error(row_no, message):
+        print(f"Błąd przy wierszu {row_no}: {message}")
+        summary["errors"] += 1
+        summary["error_rows"].append((row_no, message))
+
+    # 2. Grafiki: tylko pliki wskazane w arkuszu, sprawdzone przed zapisem czegokolwiek
+    z = zipfile.ZipFile(zip_file, 'r')
+    referenced = {str(r[col]) for r in records for col in IMAGE_COLUMNS if pd.notna(r.get(col))}
+    bad_images = check_zip_members(z, referenced)
+    stored, failed = extract_images(z, referenced - bad_images.keys())
+    bad_images.update(failed)
+    z.close()
+
+    # 3. Walidacja wierszy (przed jakimkolwiek zapisem do bazy)
+    valid_rows = []
+    for idx, row in enumerate(records):
+        row_no = idx + 2  # Numer wiersza w Excelu (wiersz 1 to nagłówki)
         try:
-            # Pobieranie lub tworzenie relacji (Rodzaje i Grupy)
-            test_types = []
-            if pd.notna(row.get('Rodzaje')):
-                for t_name in str(row['Rodzaje']).split(','):
-                    t_name = t_name.strip()
-                    t_obj = session.query(TestType).filter_by(name=t_name).first()
-                    if not t_obj:
-                        t_obj = TestType(name=t_name)
-                        session.add(t_obj)
-                        session.flush()
-                    test_types.append(t_obj)
-
-            professions = []
-            if pd.notna(row.get('Grupy')):
-                for p_name in str(row['Grupy']).split(','):
-                    p_name = p_name.strip()
-                    p_obj = session.query(ProfessionGroup).filter_by(name=p_name).first()
-                    if not p_obj:
-                        p_obj = ProfessionGroup(name=p_name)
-                        session.add(p_obj)
-                        session.flush()
-                    professions.append(p_obj)
-
-            # Tworzenie obiektu pytania
-            new_q = Question(
-                content=str(row['Tresc']),
-                ans_a=str(row['Odp_A']),
-                image_a=os.path.join(UPLOAD_FOLDER, str(row['Grafika_A'])) if pd.notna(row.get('Grafika_A')) else None,
-                ans_b=str(row['Odp_B']),
-                image_b=os.path.join(UPLOAD_FOLDER, str(row['Grafika_B'])) if pd.notna(row.get('Grafika_B')) else None,
-                ans_c=str(row['Odp_C']),
-                image_c=os.path.join(UPLOAD_FOLDER, str(row['Grafika_C'])) if pd.notna(row.get('Grafika_C')) else None,
-                correct_ans=str(row['Poprawna']).upper().strip(),
-                image_path=os.path.join(UPLOAD_FOLDER, str(row['Grafika_Glowna'])) if pd.notna(row.get('Grafika_Glowna')) else None,
-                test_types=test_types,
-                professions=professions
-            )
-            
-            session.add(new_q)
-            summary["success"] += 1
-            
+            correct = str(row['Poprawna']).upper().strip()
+            if correct not in ("A", "B", "C"):
+                raise ValueError(f"Nieprawidłowa poprawna odpowiedź: '{row['Poprawna']}'")
+
+            images = {}
+            for col in IMAGE_COLUMNS:
+                name = str(row[col]) if pd.notna(row.get(col)) else None
+                if name in bad_images:
+                    raise ValueError(bad_images[name])
+                images[col] = stored.get(name)
+
+            data = {
+                "content": str(row['Tresc']),
+                "ans_a": str(row['Odp_A']),
+                "image_a": images['Grafika_A'],
+                "ans_b": str(row['Odp_B']),
+                "image_b": images['Grafika_B'],
+                "ans_c": str(row['Odp_C']),
+                "image_c": images['Grafika_C'],
+                "correct_ans": correct,
+                "image_path": images['Grafika_Glowna'],
+                "comment": str(row['Komentarz']) if pd.notna(row.get('Komentarz')) else None,
+                "total_attempts": 0,
+                "correct_attempts": 0,
+                "pass_rate": 0.0,
+            }
+            valid_rows.append((row_no, data, split_names(row.get('Rodzaje')), split_names(row.get('Grupy'))))
+        except KeyError as e:
+            row_error(row_no, f"Brak kolumny: {e}")
         except Exception as e:
-            print(f"Błąd przy wierszu: {e}")
-            summary["errors"] += 1
+            row_error(row_no, str(e))
+
+    report()
 
+    # 4. Słowniki: wszystkie nazwy rodzajów i grup rozwiązywane z góry (po jednym zapytaniu)
+    type_names = sorted({n for _, _, types, _ in valid_rows for n in types})
+    prof_names = sorted({n for _, _, _, profs in valid_rows for n in profs})
+    type_ids = resolve_categories(session, TestType, type_names)
+    prof_ids = resolve_categories(session, ProfessionGroup, prof_names)
     session.commit()
-    return summary
\ No newline at end of file
+    invalidate_reference_cache()  # Import mógł utworzyć nowe grupy / rodzaje testów
+
+    def flush(chunk):
+        """Zapis porcji; przy błędzie porcja jest powtarzana wiersz po wierszu, aby wskazać winne wiersze."""
+        if not chunk:
+            return
+        try:
+            insert_chunk(session, chunk)
+            session.commit()
+            summary["success"] += len(chunk)
+        except Exception:
+            session.rollback()
+            for item in chunk:
+                try:
+                    insert_chunk(session, [item])
+                    session.commit()
+                    summary["success"] += 1
+                except Exception as e:
+                    session.rollback()
+                    row_error(item[0], str(e))
+
+    # 5. Zapis porcjami
+    for start in range(0, len(valid_rows), chunk_size):
+        flush([
+            # dict.fromkeys: 'Ruchowe, ruchowe' w jednej komórce to to samo powiązanie
+            (row_no, data, list(dict.fromkeys(type_ids[n] for n in types)),
+             list(dict.fromkeys(prof_ids[n] for n in profs)))
+            for row_no, data, types, profs in valid_rows[start:start + chunk_size]
+        ])
+        report()
+
+    invalidate_question_pool()
+    return summary
+
+
+# --- IMPORT W TLE ---
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_job_pool = None
+_job_pool_lock = threading.Lock()
+_owned_jobs = set()  # Zadania tego procesu (w kolejce lub w toku) - dla nich odnawiany jest heartbeat_at
+
+def _get_job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=config.IMPORT_JOB_WORKERS, thread_name_prefix="import")
+            threading.Thread(target=_heartbeat_loop, name="import-heartbeat", daemon=True).start()
+        return _job_pool
+
+def _heartbeat_loop():
+    """Co IMPORT_JOB_HEARTBEAT_SECONDS potwierdza w bazie, że zadania tego procesu nadal żyją."""
+    while True:
+        time.sleep(config.IMPORT_JOB_HEARTBEAT_SECONDS)
+        with _job_pool_lock:
+            job_ids = list(_owned_jobs)
+        if not job_ids:
+            continue
+        session = get_session()
+        try:
+            session.query(ImportJob).filter(ImportJob.id.in_(job_ids), ImportJob.status.in_(ACTIVE_STATUSES)) \
+                .update({"heartbeat_at": datetime.now()}, synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"Błąd odnawiania zadań importu: {e}")
+        finally:
+            session.close()
+
+def _update_job(job_id, **values):
+    session = get_session()
+    try:
+        session.query(ImportJob).filter(ImportJob.id == job_id).update(values)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd aktualizacji zadania importu {job_id}: {e}")
+    finally:
+        session.close()
+
+def _run_import_job(job_id, excel_path, zip_path):
+    """Wykonanie zadania w wątku roboczym; postęp zapisywany w tabeli import_jobs."""
+    _update_job(job_id, status="running", started_at=datetime.now(), heartbeat_at=datetime.now())
+
+    def progress(summary, total_rows):
+        _update_job(job_id, total_rows=total_rows, rows_done=summary["success"] + summary["errors"],
+                    success=summary["success"], errors=summary["errors"])
+
+    session = get_session()
+    try:
+        summary = run_mass_import(excel_path, zip_path, session, progress=progress)
+        _update_job(job_id, status="done", finished_at=datetime.now(),
+                    success=summary["success"], errors=summary["errors"],
+                    error_rows=json.dumps(summary["error_rows"], ensure_ascii=False))
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd zadania importu {job_id}: {e}")
+        _update_job(job_id, status="failed", finished_at=datetime.now(), message=str(e))
+    finally:
+        session.close()
+        shutil.rmtree(os.path.dirname(excel_path), ignore_errors=True)
+        with _job_pool_lock:
+            _owned_jobs.discard(job_id)
+
+def start_import_job(excel_file, zip_file, user_id=None):
+    """
+    Zapisuje przesłane pliki na dysk, tworzy rekord zadania i zleca import w tle.
+    Zadanie działa niezależnie od sesji przeglądarki. Zwraca ID zadania
+    (gdy nie udało się zapisać plików - zadanie od razu ma status 'failed' z opisem błędu).
+    """
+    session = get_session()
+    try:
+        job = ImportJob(user_id=user_id, host=socket.gethostname(), status="queued",
+                        excel_name=excel_file.name, zip_name=zip_file.name, heartbeat_at=datetime.now())
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    finally:
+        session.close()
+
+    job_dir = os.path.join(config.IMPORT_JOBS_DIR, str(job_id))
+    try:
+        os.makedirs(job_dir, exist_ok=True)
+        paths = []
+        for uploaded, name in [(excel_file, "arkusz.xlsx"), (zip_file, "grafiki.zip")]:
+            path = os.path.join(job_dir, name)
+            uploaded.seek(0)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(uploaded, f, 1024 * 1024)
+            paths.append(path)
+        pool = _get_job_pool()
+        with _job_pool_lock:
+            _owned_jobs.add(job_id)
+        pool.submit(_run_import_job, job_id, *paths)
+    except Exception as e:
+        # Bez tego zadanie zostałoby na zawsze 'w kolejce'
+        print(f"Błąd przygotowania zadania importu {job_id}: {e}")
+        with _job_pool_lock:
+            _owned_jobs.discard(job_id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        _update_job(job_id, status="failed", finished_at=datetime.now(),
+                    message=f"Nie udało się zapisać przesłanych plików: {e}")
+    return job_id
+
+def get_latest_import_job(user_id):
+    """Ostatnie zadanie importu użytkownika (odłączony obiekt) lub None."""
+    fail_stale_jobs()
+    session = get_session()
+    try:
+        job = session.query(ImportJob).filter(ImportJob.user_id == user_id) \
+            .order_by(ImportJob.created_at.desc(), ImportJob.id.desc()).first()
+        if job:
+            session.expunge(job)
+        return job
+    finally:
+        session.close()
+
+def fail_stale_jobs():
+    """
+    Zadania bez odnowionego heartbeat_at przez IMPORT_JOB_STALE_SECONDS oznacza jako nieudane -
+    ich proces został zatrzymany (restart, usunięty kontener, inna replika), więc nikt ich nie dokończy.
+    """
+    deadline = datetime.now() - timedelta(seconds=config.IMPORT_JOB_STALE_SECONDS)
+    session = get_session()
+    try:
+        session.query(ImportJob).filter(
+            ImportJob.status.in_(ACTIVE_STATUSES),
+            or_(ImportJob.heartbeat_at < deadline,
+                and_(ImportJob.heartbeat_at.is_(None), ImportJob.created_at < deadline))
+        ).update({"status": "failed", "finished_at": datetime.now(),
+                  "message": "Przerwane - proces wykonujący import został zatrzymany"}, synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd porządkowania zadań importu: {e}")
+    finally:
+        session.close()
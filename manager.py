@@ -1,15 +1,130 @@
 import bcrypt
 import random
-from sqlalchemy.sql import func
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert
 from sqlalchemy.orm import Session, joinedload
-from db import get_session, User, ProfessionGroup, TestType, Question
+from db import (init_db, get_session, get_professions, invalidate_reference_cache, User, ProfessionGroup, TestType, LoginFailure, get_questions_by_ids,
+                get_question_pool,
+                question_profession_m2m, question_test_type_m2m)
 import config
+import importer
+import migrations
+import media_server
+
+# --- BCRYPT: ograniczona pula wątków ---
+
+_auth_pool = ThreadPoolExecutor(max_workers=config.AUTH_WORKERS, thread_name_prefix="bcrypt")
+_auth_slots = threading.BoundedSemaphore(config.AUTH_MAX_PENDING)
+
+def _run_auth_task(fn, *args):
+    """
+    Wykonuje operację bcrypt w puli wątków (nie blokuje renderowania innych stron).
+    Przy przepełnieniu kolejki zgłasza TimeoutError zamiast gromadzić zadania.
+    """
+    if not _auth_slots.acquire(timeout=config.AUTH_TIMEOUT):
+        raise TimeoutError("Przekroczono limit równoczesnych operacji logowania")
+    try:
+        return _auth_pool.submit(fn, *args).result(timeout=config.AUTH_TIMEOUT)
+    finally:
+        _auth_slots.release()
+
+def _hash(password):
+    salt = bcrypt.gensalt(rounds=config.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
 def hash_password(password):
-    """Zmienia czyste hasło na bezpieczny hash."""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    """Zmienia czyste hasło na bezpieczny hash (koszt z config.BCRYPT_ROUNDS)."""
+    return _run_auth_task(_hash, password)
+
+def hash_rounds(password_hash):
+    """Koszt zapisany w hashu bcrypt ($2b$12$...) lub None dla nieznanego formatu."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+# --- OGRANICZENIE NIEUDANYCH LOGOWAŃ ---
+
+# Liczniki są w bazie (tabela login_failures), więc limity obowiązują łącznie dla wszystkich
+# procesów gunicorn i replik, a nie osobno dla każdego z nich.
+
+def client_address(forwarded_for, peer):
+    """
+    Adres klienta za Nginx Proxy Managerem: ostatni adres z X-Forwarded-For (dopisany przez proxy).
+    Wcześniejsze pozycje przysyła sam klient - można je podrobić, więc nie nadają się do blokad.
+    """
+    if forwarded_for:
+        last = forwarded_for.split(",")[-1].strip()
+        if last:
+            return last
+    return peer
+
+def _failure_keys(username, ip):
+    """[(klucz, limit)] sprawdzane przy logowaniu: nazwa użytkownika i (jeśli znany) adres IP."""
+    keys = [(f"user:{(username or '').lower()}"[:100], config.LOGIN_MAX_FAILURES_USER)]
+    if ip:
+        keys.append((f"ip:{ip}"[:100], config.LOGIN_MAX_FAILURES_IP))
+    return keys
+
+class LoginLocked(Exception):
+    """Logowanie zablokowane po zbyt wielu nieudanych próbach; seconds - czas do końca blokady."""
+    def __init__(self, seconds):
+        super().__init__(f"Zbyt wiele nieudanych prób logowania. Spróbuj ponownie za {seconds} s.")
+        self.seconds = seconds
+
+def _login_lockout_remaining(username, ip=None):
+    """Liczba sekund do końca blokady logowania dla nazwy użytkownika / adresu IP (0 = brak blokady)."""
+    now = datetime.now()
+    window_start = now - timedelta(seconds=config.LOGIN_LOCKOUT_SECONDS)
+    remaining = 0
+    session = get_session()
+    try:
+        for key, limit in _failure_keys(username, ip):
+            # limit najnowszych prób w oknie; blokada trwa, dopóki najstarsza z nich nie wygaśnie
+            recent = session.query(LoginFailure.failed_at).filter(
+                LoginFailure.key == key, LoginFailure.failed_at > window_start
+            ).order_by(LoginFailure.failed_at.desc()).limit(limit).all()
+            if len(recent) >= limit:
+                oldest = recent[-1][0]
+                remaining = max(remaining, int(config.LOGIN_LOCKOUT_SECONDS - (now - oldest).total_seconds()) + 1)
+    finally:
+        session.close()
+    return remaining
+
+def _register_login_failure(username, ip=None):
+    now = datetime.now()
+    session = get_session()
+    try:
+        session.execute(insert(LoginFailure.__table__),
+                        [{"key": key, "failed_at": now} for key, _ in _failure_keys(username, ip)])
+        # Wygasłe wpisy usuwamy przy okazji - tabela nie rośnie ponad liczbę prób z jednego okna
+        session.query(LoginFailure).filter(
+            LoginFailure.failed_at < now - timedelta(seconds=config.LOGIN_LOCKOUT_SECONDS)
+        ).delete(synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd zapisu nieudanego logowania: {e}")
+    finally:
+        session.close()
+
+def _clear_login_failures(username):
+    session = get_session()
+    try:
+        session.query(LoginFailure).filter(LoginFailure.key == _failure_keys(username, None)[0][0]) \
+            .delete(synchronize_session=False)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Błąd czyszczenia nieudanych logowań: {e}")
+    finally:
+        session.close()
 
 def init_system_data():
     """Inicjalizuje grupy zawodowe i konto administratora przy pierwszym uruchomieniu."""
@@ -34,12 +149,42 @@ def init_system_data():
             session.add(admin)
         
         session.commit()
+        invalidate_reference_cache()
+        return True
     except Exception as e:
         session.rollback()
         print(f"Błąd inicjalizacji danych: {e}")
+        return False
     finally:
         session.close()
 
+_bootstrap_done = False
+_bootstrap_lock = threading.Lock()
+
+def bootstrap():
+    """
+    Jednorazowa (na proces) inicjalizacja tabel i danych startowych.
+    Streamlit wykonuje app.py przy każdej interakcji - kolejne wywołania nic nie kosztują.
+    Przy błędzie (np. baza jeszcze nie wstała) inicjalizacja zostanie ponowiona przy następnym wywołaniu.
+    """
+    global _bootstrap_done
+    if _bootstrap_done:
+        return
+    with _bootstrap_lock:
+        if _bootstrap_done:
+            return
+        if config.MEDIA_BASE_URL:
+            media_server.start_in_background()
+        start = time.perf_counter()
+        try:
+            init_db()
+            migrations.upgrade()
+            _bootstrap_done = init_system_data()
+            importer.fail_stale_jobs()
+        except Exception as e:
+            print(f"Błąd inicjalizacji bazy: {e}")
+        print(f"Inicjalizacja systemu: {'OK' if _bootstrap_done else 'BŁĄD'} ({time.perf_counter() - start:.3f} s)")
+
 def create_user(username, password, role, profession_ids=None):
     """Tworzy nowego użytkownika i przypisuje mu grupy zawodowe."""
     session = get_session()
@@ -60,16 +205,34 @@ def create_user(username, password, role, profession_ids=None):
     finally:
         session.close()
 
-def authenticate_user(username, password):
+def authenticate_user(username, password, ip=None):
+    """
+    Logowanie. Zablokowane nazwy/adresy odrzucane są przed liczeniem bcrypt (LoginLocked z czasem blokady);
+    hash o koszcie innym niż config.BCRYPT_ROUNDS jest przeliczany po udanym logowaniu.
+    Przepełniona pula bcrypt zgłasza TimeoutError - to nie jest błędne hasło, decyzję zostawiamy wołającemu.
+    """
+    wait = _login_lockout_remaining(username, ip)
+    if wait:
+        raise LoginLocked(wait)
     session = get_session()
     try:
         user = session.query(User).options(joinedload(User.professions)).filter_by(username=username).first()
         if user and user.password_hash:
-            if bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
+            if _run_auth_task(_check, password, user.password_hash):
+                if hash_rounds(user.password_hash) != config.BCRYPT_ROUNDS:
+                    user.password_hash = hash_password(password)
+                    session.commit()
+                    user = session.query(User).options(joinedload(User.professions)).filter_by(id=user.id).first()
+                _clear_login_failures(username)
                 session.expunge(user)
                 return user
+        _register_login_failure(username, ip)
         return None
+    except TimeoutError:
+        session.rollback()
+        raise
     except Exception as e:
+        session.rollback()
         print(f"Błąd logowania: {e}")
         return None
     finally:
@@ -112,39 +275,112 @@ def get_all_users():
         session.close()
 
 def get_all_professions():
-    session = get_session()
-    profs = session.query(ProfessionGroup).all()
-    session.close()
-    return profs
+    """Grupy zawodowe z cache słowników (RefItem: id, name)."""
+    return get_professions()
 
-def get_balanced_questions(profession_id, topic_ids, total_count):
-    """Pobiera zbalansowaną liczbę pytań z wybranych kategorii."""
-    session = get_session()
-    final_questions = []
-    
-    if not topic_ids:
+def draw_exam_ids(profession_id, test_type_id, count=30, rng=None):
+    """
+    Losowanie pytań do egzaminu (Streamlit i API): bez powtórzeń, gdy pula jest wystarczająca,
+    w przeciwnym razie z powtórzeniami. Zwraca listę ID (pusta, gdy brak pytań).
+    """
+    rng = rng or random
+    # Losujemy na samych ID z indeksu pul, pełne wiersze pobiera wywołujący
+    pool = get_question_pool(profession_id, test_type_id)
+    if not pool:
         return []
+    if len(pool) >= count:
+        return rng.sample(pool, count)
+    return rng.choices(pool, k=count)
 
-    # Obliczamy bazową liczbę pytań na kategorię
-    questions_per_topic = total_count // len(topic_ids)
-    remainder = total_count % len(topic_ids)
+def get_balanced_questions(profession_id, topic_ids, total_count, rng=None):
+    """
+    Pobiera zbalansowaną liczbę pytań z wybranych kategorii.
+    Kandydaci dla wszystkich kategorii pobierani są jednym zapytaniem (same ID),
+    podział i losowanie odbywa się w Pythonie, a pełne wiersze pobierane są
+    jednym zapytaniem po kluczu głównym. Brakujące pytania z mniejszych kategorii
+    uzupełniane są z pozostałych.
+    rng: opcjonalny random.Random (powtarzalne losowanie z ziarnem).
+    """
+    rng = rng or random
+    if not topic_ids:
+        return []
 
+    session = get_session()
     try:
-        for i, t_id in enumerate(topic_ids):
-            num_to_take = questions_per_topic + (1 if i < remainder else 0)
-            
-            # Filtrowanie dla relacji Many-to-Many
-            query = session.query(Question).filter(
-                Question.professions.any(id=profession_id),
-                Question.test_types.any(id=t_id)
-            ).order_by(func.rand()).limit(num_to_take)
-            
-            final_questions.extend(query.all())
-            
-        random.shuffle(final_questions)
-        return final_questions
+        rows = session.query(
+            question_test_type_m2m.c.test_type_id, question_test_type_m2m.c.question_id
+        ).join(
+            question_profession_m2m,
+            question_profession_m2m.c.question_id == question_test_type_m2m.c.question_id
+        ).filter(
+            question_profession_m2m.c.profession_id == profession_id,
+            question_test_type_m2m.c.test_type_id.in_(topic_ids)
+        ).order_by(
+            # Stała kolejność kandydatów - bez niej to samo ziarno rng dawałoby różne warianty
+            question_test_type_m2m.c.test_type_id, question_test_type_m2m.c.question_id
+        ).all()
     except Exception as e:
         print(f"Błąd losowania: {e}")
         return []
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+    candidates = {t_id: [] for t_id in topic_ids}
+    for t_id, q_id in rows:
+        candidates[t_id].append(q_id)
+
+    # Obliczamy bazową liczbę pytań na kategorię
+    questions_per_topic = total_count // len(topic_ids)
+    remainder = total_count % len(topic_ids)
+
+    picked = []
+    seen = set()  # Pytanie przypisane do kilku kategorii losujemy tylko raz
+    leftovers = {}
+    for i, t_id in enumerate(topic_ids):
+        num_to_take = questions_per_topic + (1 if i < remainder else 0)
+        pool = [q_id for q_id in candidates[t_id] if q_id not in seen]
+        rng.shuffle(pool)
+        for q_id in pool[:num_to_take]:
+            seen.add(q_id)
+            picked.append(q_id)
+        leftovers[t_id] = pool[num_to_take:]
+
+    # Redystrybucja braków: po jednym pytaniu z każdej kategorii, która ma jeszcze zapas
+    missing = total_count - len(picked)
+    while missing > 0:
+        progress = False
+        for t_id in topic_ids:
+            pool = leftovers[t_id]
+            while pool and pool[-1] in seen:
+                pool.pop()
+            if pool and missing > 0:
+                q_id = pool.pop()
+                seen.add(q_id)
+                picked.append(q_id)
+                missing -= 1
+                progress = True
+        if not progress:
+            break
+
+    final_questions = get_questions_by_ids(picked)
+    rng.shuffle(final_questions)
+    return final_questions
+
+def draw_exam_variants(profession_id, topic_ids, total_count, variant_count, seed=None):
+    """
+    Losuje wiele wariantów arkusza (te same kryteria, osobne losowania).
+    Przy podanym ziarnie wynik jest powtarzalny. Zestawy identyczne z już wylosowanym
+    są losowane ponownie (kilka prób - mała pula może nie pozwolić na różne warianty).
+    """
+    rng = random.Random(seed)
+    variants = []
+    seen_sets = set()
+    for _ in range(variant_count):
+        for _attempt in range(5):
+            questions = get_balanced_questions(profession_id, topic_ids, total_count, rng=rng)
+            key = frozenset(q.id for q in questions)
+            if key not in seen_sets:
+                break
+        seen_sets.add(key)
+        variants.append(questions)
+    return variants
\ No newline at end of file
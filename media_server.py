@@ -0,0 +1,115 @@
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote
+import config
+
+# Adresy grafik zawierają wersję treści (obrazy.image_url), więc przeglądarka może je trzymać bez rewalidacji
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+CHUNK_SIZE = 64 * 1024
+
+_server = None
+_server_lock = threading.Lock()
+
+def _etag(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def resolve(url_path):
+    """Ścieżka na dysku dla adresu /<ścieżka w uploads>; None dla plików spoza magazynu grafik."""
+    rel = unquote(url_path).lstrip("/")
+    ext = rel.rsplit(".", 1)[-1].lower()
+    if not rel or ext not in CONTENT_TYPES:
+        return None
+    root = os.path.realpath(config.UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, rel))
+    # Ochrona przed ../ i dowiązaniami wychodzącymi poza UPLOAD_DIR; pliki tymczasowe (.xxx.tmp) pomijamy
+    if os.path.commonpath([root, path]) != root or os.path.basename(path).startswith("."):
+        return None
+    return path
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Statyczne grafiki z UPLOAD_DIR: długi cache, ETag / Last-Modified i odpowiedzi 304."""
+    server_version = "testy-media"
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        path = resolve(urlsplit(self.path).path)
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        etag = _etag(st)
+        if self._not_modified(etag, st.st_mtime):
+            self.send_response(304)
+            self._cache_headers(etag, st.st_mtime)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[path.rsplit(".", 1)[-1].lower()])
+        self.send_header("Content-Length", str(st.st_size))
+        self.send_header("X-Content-Type-Options", "nosniff")
+        self._cache_headers(etag, st.st_mtime)
+        self.end_headers()
+        if body:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    self.wfile.write(chunk)
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _cache_headers(self, etag, mtime):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        self.send_header("Cache-Control", CACHE_CONTROL)
+
+    def log_message(self, format, *args):
+        # Każde żądanie grafiki (także 404 po usunięciu pliku) w logu kontenera to szum
+        pass
+
+def start_in_background():
+    """
+    Uruchamia serwer grafik w wątku procesu Streamlit (raz na proces).
+    Zajęty port (np. druga instancja w tym samym kontenerze) nie blokuje aplikacji.
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((config.MEDIA_HOST, config.MEDIA_PORT), MediaHandler)
+        except OSError as e:
+            print(f"Serwer grafik: port {config.MEDIA_PORT} niedostępny ({e})")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="media-server", daemon=True).start()
+        print(f"Serwer grafik: {config.MEDIA_HOST}:{config.MEDIA_PORT} -> {config.MEDIA_BASE_URL}")
+        return _server
+
+if __name__ == "__main__":
+    # Użycie: python media_server.py  - serwer grafik jako osobny proces (np. osobny kontener)
+    server = ThreadingHTTPServer((config.MEDIA_HOST, config.MEDIA_PORT), MediaHandler)
+    print(f"Serwer grafik: {config.MEDIA_HOST}:{config.MEDIA_PORT}")
+    server.serve_forever()
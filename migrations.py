@@ -0,0 +1,117 @@
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, select, text
+from db import engine, question_profession_m2m, question_test_type_m2m, Question, ExamAttempt, ExamAnswer, ImportJob
+
+# Tabela z listą wykonanych migracji (osobne metadane - nie jest modelem aplikacji)
+_meta = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _meta,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+def _create_index(conn, table, name):
+    """Tworzy indeks zdefiniowany w modelu, jeśli jeszcze go nie ma w bazie."""
+    existing = {ix['name'] for ix in inspect(conn).get_indexes(table.name)}
+    if name not in existing:
+        index = next(ix for ix in table.indexes if ix.name == name)
+        index.create(bind=conn)
+
+def _add_column(conn, table, name):
+    """Dodaje kolumnę zdefiniowaną w modelu, jeśli jeszcze jej nie ma w bazie."""
+    existing = {col['name'] for col in inspect(conn).get_columns(table.name)}
+    if name not in existing:
+        column = table.c[name]
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+        conn.execute(text(ddl + ("" if column.nullable else " NOT NULL")))
+
+def _m1_link_table_indexes(conn):
+    _create_index(conn, question_profession_m2m, 'ix_question_profession_profession')
+    _create_index(conn, question_test_type_m2m, 'ix_question_test_type_test_type')
+
+def _m2_questions_pass_rate_index(conn):
+    _create_index(conn, Question.__table__, 'ix_questions_pass_rate')
+
+def _m3_history_and_job_indexes(conn):
+    # Tabele z wcześniejszych wersji mogły powstać bez indeksów (create_all ich nie dodaje)
+    _create_index(conn, ExamAttempt.__table__, 'ix_exam_attempts_user_finished')
+    _create_index(conn, ExamAnswer.__table__, 'ix_exam_answers_question')
+    _create_index(conn, ImportJob.__table__, 'ix_import_jobs_user_created')
+
+def _m4_exam_attempt_nonce(conn):
+    _add_column(conn, ExamAttempt.__table__, 'exam_nonce')
+    _create_index(conn, ExamAttempt.__table__, 'ux_exam_attempts_nonce')
+
+def _m5_import_job_heartbeat(conn):
+    _add_column(conn, ImportJob.__table__, 'heartbeat_at')
+
+def _m6_questions_pass_rate_not_null(conn):
+    # Filtr zdawalności na gołej kolumnie (bez COALESCE) może użyć indeksu z migracji 2
+    conn.execute(text("UPDATE questions SET pass_rate = 0 WHERE pass_rate IS NULL"))
+    if conn.dialect.name == "mysql":
+        conn.execute(text("ALTER TABLE questions MODIFY pass_rate FLOAT NOT NULL DEFAULT 0"))
+
+def _m7_exam_answers_keep_deleted_questions(conn):
+    # SQLite (środowisko testowe) nie zmienia kluczy obcych przez ALTER - dotyczy tylko MariaDB
+    if conn.dialect.name != "mysql":
+        return
+    def question_fks():
+        return [fk for fk in inspect(conn).get_foreign_keys('exam_answers') if fk['referred_table'] == 'questions']
+    for fk in question_fks():
+        if (fk.get('options') or {}).get('ondelete', '').upper() != 'SET NULL':
+            conn.execute(text(f"ALTER TABLE exam_answers DROP FOREIGN KEY {fk['name']}"))
+    conn.execute(text("ALTER TABLE exam_answers MODIFY question_id INTEGER NULL"))
+    if not question_fks():
+        conn.execute(text("ALTER TABLE exam_answers ADD CONSTRAINT fk_exam_answers_question "
+                          "FOREIGN KEY (question_id) REFERENCES questions (id) ON DELETE SET NULL"))
+
+# Lista migracji: (wersja, opis, funkcja). Nowe migracje dopisujemy na końcu, nigdy nie zmieniamy starych.
+MIGRATIONS = [
+    (1, "Indeksy odwrotne na tabelach powiązań pytań", _m1_link_table_indexes),
+    (2, "Indeks zdawalności pytań", _m2_questions_pass_rate_index),
+    (3, "Indeksy historii egzaminów i zadań importu", _m3_history_and_job_indexes),
+    (4, "Unikalny identyfikator egzaminu z API w historii podejść", _m4_exam_attempt_nonce),
+    (5, "Znacznik życia zadań importu", _m5_import_job_heartbeat),
+    (6, "Zdawalność pytań bez wartości NULL", _m6_questions_pass_rate_not_null),
+    (7, "Historia odpowiedzi zachowywana po usunięciu pytania", _m7_exam_answers_keep_deleted_questions),
+]
+
+def current_version(conn):
+    schema_migrations.create(bind=conn, checkfirst=True)
+    return conn.execute(select(schema_migrations.c.version).order_by(schema_migrations.c.version.desc())).scalar() or 0
+
+def upgrade():
+    """
+    Wykonuje brakujące migracje na istniejącej bazie (po Base.metadata.create_all).
+    Przy kilku instancjach startujących naraz MariaDB serializuje je blokadą GET_LOCK.
+    Zwraca listę wykonanych wersji.
+    """
+    applied = []
+    with engine.connect() as conn:
+        use_lock = conn.dialect.name == "mysql"
+        if use_lock:
+            conn.execute(text("SELECT GET_LOCK('testy_migrations', 300)"))
+        try:
+            version = current_version(conn)
+            conn.commit()
+            for number, description, migrate in MIGRATIONS:
+                if number <= version:
+                    continue
+                # DDL w MariaDB zatwierdza się natychmiast - każda migracja musi być idempotentna
+                migrate(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=number, description=description, applied_at=datetime.now()))
+                conn.commit()
+                applied.append(number)
+                print(f"Migracja {number}: {description} - OK")
+        finally:
+            if use_lock:
+                conn.execute(text("SELECT RELEASE_LOCK('testy_migrations')"))
+    return applied
+
+if __name__ == "__main__":
+    # Użycie: python migrations.py  - wykonuje brakujące migracje i wypisuje wersję schematu
+    upgrade()
+    with engine.connect() as conn:
+        print(f"Wersja schematu: {current_version(conn)}")
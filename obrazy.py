@@ -0,0 +1,326 @@
+import os
+import sys
+import glob
+import time
+import uuid
+import threading
+import hashlib
+from urllib.parse import quote
+from PIL import Image, ImageOps
+from sqlalchemy import select, union
+import config
+from db import get_session, Question
+
+CHUNK_SIZE = 1024 * 1024  # Strumieniowy zapis/hashowanie po 1 MB
+GC_GRACE_SECONDS = 3600    # Świeże pliki (np. zapis w toku, przed commitem) nie są usuwane
+
+# Wydanie ścieżki przez store_file i usuwanie w release_files wykluczają się w obrębie procesu
+_files_lock = threading.Lock()
+
+# Warianty: nazwa -> (dłuższy bok w px, format zapisu)
+VARIANTS = {
+    "thumb": (config.QUESTION_IMAGE_SIZE, "WEBP"),
+    "display": (config.IMAGE_DISPLAY_SIZE, "WEBP"),
+    # ReportLab wstawia JPEG do PDF bez ponownego kodowania (DCTDecode) - dotyczy też ramek z pdf_service
+    "print": (config.IMAGE_PRINT_SIZE, "JPEG"),
+}
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+def _derivative_base(image_path):
+    """
+    Ścieżka bazowa pochodnych (bez wariantu), odwzorowująca strukturę uploads/.
+    Rozszerzenie oryginału zostaje w nazwie (x.png -> x_png), żeby x.png i x.jpg nie nadpisywały sobie pochodnych.
+    """
+    rel = os.path.relpath(image_path, config.UPLOAD_DIR)
+    if rel.startswith(".."):
+        rel = os.path.basename(image_path)
+    root, ext = os.path.splitext(rel)
+    return os.path.join(config.DERIVATIVES_DIR, f"{root}_{ext[1:]}" if ext else root)
+
+def _derivative_path(image_path, variant, fmt):
+    return f"{_derivative_base(image_path)}.{variant}.{EXTENSIONS[fmt]}"
+
+def _find_existing(image_path, variant):
+    """Zwraca aktualną (nie starszą niż oryginał) pochodną lub None."""
+    base = _derivative_base(image_path)
+    try:
+        src_mtime = os.path.getmtime(image_path)
+    except OSError:
+        return None
+    for ext in ("webp", "jpg", "png"):
+        candidate = f"{base}.{variant}.{ext}"
+        try:
+            if os.path.getmtime(candidate) >= src_mtime:
+                return candidate
+        except OSError:
+            continue
+    return None
+
+def _save_variant(img, image_path, variant):
+    size, fmt = VARIANTS[variant]
+    out = img.copy()
+    out.thumbnail((size, size), Image.LANCZOS)  # Nie powiększa mniejszych obrazów
+
+    has_alpha = out.mode in ("RGBA", "LA") or (out.mode == "P" and "transparency" in out.info)
+    if fmt == "JPEG" and has_alpha:
+        fmt = "PNG"  # Zachowujemy przezroczystość (np. schematy sygnałów)
+    if fmt == "JPEG":
+        out = out.convert("RGB")
+        params = {"quality": 90, "optimize": True}
+    elif fmt == "WEBP":
+        out = out.convert("RGBA" if has_alpha else "RGB")
+        params = {"quality": config.IMAGE_WEBP_QUALITY, "method": 4}
+    else:
+        params = {"optimize": True}
+
+    target = _derivative_path(image_path, variant, fmt)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    out.save(tmp, fmt, **params)
+    os.replace(tmp, target)  # Atomowa podmiana - równoległe żądania nie widzą połowy pliku
+    return target
+
+def create_derivatives(image_path):
+    """
+    Tworzy wszystkie warianty grafiki (miniatura, wyświetlanie, druk).
+    Wywoływane przy zapisie w edytorze i imporcie. Zwraca słownik wariant -> ścieżka.
+    """
+    if not image_path or not os.path.exists(image_path):
+        return {}
+    try:
+        with Image.open(image_path) as img:
+            img = ImageOps.exif_transpose(img)  # Zdjęcia z telefonu - orientacja z EXIF
+            img.load()
+            return {variant: _save_variant(img, image_path, variant) for variant in VARIANTS}
+    except Exception as e:
+        print(f"Błąd generowania wariantów dla {image_path}: {e}")
+        return {}
+
+def is_valid_image(image_path):
+    """Sprawdza, czy plik jest poprawną grafiką (nagłówek i struktura, bez pełnego dekodowania)."""
+    try:
+        with Image.open(image_path) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+def variant_path(image_path, variant, create=True):
+    """
+    Zwraca ścieżkę do wariantu grafiki dla danego odbiorcy ('thumb', 'display', 'print').
+    Brakujące pochodne są tworzone przy pierwszym użyciu; w razie błędu zwracany jest oryginał.
+    """
+    if not image_path:
+        return image_path
+    existing = _find_existing(image_path, variant)
+    if existing:
+        return existing
+    if create:
+        return create_derivatives(image_path).get(variant, image_path)
+    return image_path
+
+def image_url(image_path, variant):
+    """
+    Adres wariantu grafiki na serwerze grafik (media_server.py) lub None, gdy serwer jest wyłączony.
+    Parametr v zmienia się razem z treścią pliku (czas modyfikacji i rozmiar), więc adres
+    można cache'ować w przeglądarce bez rewalidacji - nowa wersja to nowy adres.
+    """
+    if not config.MEDIA_BASE_URL or not image_path:
+        return None
+    path = variant_path(image_path, variant)
+    rel = os.path.relpath(path, config.UPLOAD_DIR)
+    if rel.startswith(".."):
+        return None  # Plik spoza magazynu grafik - serwer go nie wyda
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{config.MEDIA_BASE_URL}/{quote(rel.replace(os.sep, '/'))}?v={st.st_mtime_ns:x}-{st.st_size:x}"
+
+def store_file(fileobj, ext, validate=False):
+    """
+    Zapisuje grafikę pod adresem wynikającym z treści: uploads/<ab>/<sha256>.<ext>.
+    Plik jest hashowany strumieniowo w trakcie zapisu; identyczna treść zapisana
+    wcześniej jest używana ponownie (deduplikacja). Zwraca ścieżkę do pliku.
+    validate=True: plik tymczasowy jest sprawdzany przed umieszczeniem w magazynie -
+    niepoprawna grafika kończy się ValueError i nie zostawia nic w uploads/.
+    """
+    ext = ext.lower().lstrip('.')
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    tmp = os.path.join(config.UPLOAD_DIR, f".{uuid.uuid4()}.tmp")
+    digest = hashlib.sha256()
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        if validate and not is_valid_image(tmp):
+            raise ValueError("plik nie jest poprawną grafiką")
+
+        h = digest.hexdigest()
+        target = os.path.join(config.UPLOAD_DIR, h[:2], f"{h}.{ext}")
+        with _files_lock:
+            if os.path.exists(target):
+                os.remove(tmp)  # Ta sama treść już jest w magazynie
+                _mark_in_use(target)
+                return target
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    create_derivatives(target)
+    return target
+
+def _mark_in_use(path):
+    """
+    Odświeża czas dostępu pliku wydanego ponownie (deduplikacja) - pytanie, które go użyje, nie jest
+    jeszcze zapisane w bazie, więc release_files i gc muszą go przez chwilę oszczędzić.
+    Czas modyfikacji zostaje bez zmian (od niego zależą pochodne i adresy wersjonowane).
+    """
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+def _recently_used(path, now):
+    """Plik zapisany lub wydany przez store_file w ciągu GC_GRACE_SECONDS."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return now - max(st.st_mtime, st.st_atime) < GC_GRACE_SECONDS
+
+def _remove_with_derivatives(path):
+    """Usuwa plik wraz ze wszystkimi jego pochodnymi. Zwraca liczbę zwolnionych bajtów."""
+    freed = 0
+    for p in [path] + glob.glob(glob.escape(_derivative_base(path)) + ".*"):
+        try:
+            freed += os.path.getsize(p)
+            os.remove(p)
+        except OSError:
+            pass
+    return freed
+
+def _referenced_paths(paths=None):
+    """Zbiór (znormalizowanych) ścieżek grafik używanych przez pytania."""
+    columns = [Question.image_path, Question.image_a, Question.image_b, Question.image_c]
+    selects = []
+    for col in columns:
+        sel = select(col.label("path")).where(col.isnot(None))
+        if paths is not None:
+            sel = sel.where(col.in_(paths))
+        selects.append(sel)
+    session = get_session()
+    try:
+        return {os.path.normpath(r[0]) for r in session.execute(union(*selects))}
+    finally:
+        session.close()
+
+def release_files(paths):
+    """
+    Usuwa podane pliki, jeśli po zmianie/usunięciu pytania nie odwołuje się do nich
+    już żadne pytanie (ta sama grafika może być współdzielona dzięki deduplikacji).
+    Pliki świeżo zapisane lub ponownie wydane przez store_file zostają - ich pytanie może być
+    jeszcze przed commitem; jeśli okażą się nieużywane, usunie je później collect_garbage.
+    """
+    paths = {p for p in paths if p}
+    if not paths:
+        return
+    try:
+        still_used = _referenced_paths(list(paths))
+        with _files_lock:
+            now = time.time()
+            for p in paths:
+                if os.path.normpath(p) in still_used or not os.path.exists(p) or _recently_used(p, now):
+                    continue
+                _remove_with_derivatives(p)
+    except Exception as e:
+        print(f"Błąd zwalniania plików: {e}")
+
+def collect_garbage(dry_run=True):
+    """
+    Odśmiecanie katalogu uploads/: porównuje pliki z odwołaniami w kolumnach
+    image_path/image_a/image_b/image_c i usuwa nieużywane (razem z pochodnymi)
+    oraz osierocone pochodne. W trybie dry_run tylko raportuje.
+    """
+    referenced = _referenced_paths()
+    derivatives_dir = os.path.abspath(config.DERIVATIVES_DIR)
+    now = time.time()
+    orphans, orphan_bytes = [], 0
+    live_bases = set()
+
+    for root, dirs, files in os.walk(config.UPLOAD_DIR):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != derivatives_dir]
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in referenced:
+                live_bases.add(os.path.abspath(_derivative_base(path)))
+                continue
+            if _recently_used(path, now):
+                continue
+            orphans.append(path)
+            orphan_bytes += os.path.getsize(path)
+
+    # Pochodne, których oryginał nie jest już używany
+    stale_derivatives = []
+    for root, _, files in os.walk(config.DERIVATIVES_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            base = os.path.abspath(os.path.join(root, name.rsplit('.', 2)[0]))  # <baza>.<wariant>.<ext>
+            if base not in live_bases and now - os.path.getmtime(path) >= GC_GRACE_SECONDS:
+                stale_derivatives.append(path)
+                orphan_bytes += os.path.getsize(path)
+
+    if not dry_run:
+        for path in orphans + stale_derivatives:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    report = {
+        "dry_run": dry_run,
+        "referenced": len(referenced),
+        "orphans": orphans,
+        "orphan_derivatives": len(stale_derivatives),
+        "bytes": orphan_bytes,
+    }
+    print(f"GC uploads ({'symulacja' if dry_run else 'usuwanie'}): nieużywane pliki {len(orphans)}, "
+          f"pochodne {len(stale_derivatives)}, {orphan_bytes / 1024 / 1024:.1f} MB")
+    for path in orphans:
+        print(f"  {path}")
+    return report
+
+def backfill(upload_dir=config.UPLOAD_DIR):
+    """Generuje brakujące lub nieaktualne pochodne dla istniejącego katalogu uploads/."""
+    done, skipped, failed = 0, 0, 0
+    derivatives_dir = os.path.abspath(config.DERIVATIVES_DIR)
+    for root, dirs, files in os.walk(upload_dir):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != derivatives_dir]
+        for name in files:
+            if name.rsplit('.', 1)[-1].lower() not in config.ALLOWED_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            if all(_find_existing(path, v) for v in VARIANTS):
+                skipped += 1
+            elif create_derivatives(path):
+                done += 1
+            else:
+                failed += 1
+    print(f"Pochodne grafik: utworzono {done}, aktualne {skipped}, błędy {failed}")
+    return {"created": done, "skipped": skipped, "errors": failed}
+
+if __name__ == "__main__":
+    # Użycie: python obrazy.py backfill [katalog]  - generowanie brakujących pochodnych
+    #         python obrazy.py gc [--apply]         - raport (lub usunięcie) nieużywanych plików
+    command = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    if command == "gc":
+        collect_garbage(dry_run="--apply" not in sys.argv)
+    else:
+        backfill(sys.argv[2] if len(sys.argv) > 2 else config.UPLOAD_DIR)
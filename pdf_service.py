@@ -4,17 +4,85 @@ from reportlab.lib.units import cm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.utils import ImageReader
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.platypus import Paragraph
 import io
 import os
 import html
+import json
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from collections import namedtuple, OrderedDict
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import obrazy
+import config
 
 # --- KONFIGURACJA ---
 MARGIN = 1 * cm
 WIDTH, HEIGHT = A4
 FONT_NAME = "Helvetica"
 
+# --- CACHE PRZESKALOWANYCH GRAFIK (LRU, wspólny dla wszystkich arkuszy w procesie) ---
+
+# (źródło, mtime/hash, szer_px, wys_px) -> bajty JPEG/PNG przeskalowane do ramki
+_image_cache = OrderedDict()
+_image_cache_lock = threading.Lock()
+_image_cache_stats = {"hits": 0, "misses": 0}
+
+def _box_pixels(box_w, box_h):
+    """Wymiary ramki (w punktach PDF) przeliczone na piksele przy PDF_IMAGE_DPI."""
+    return round(box_w / 72 * config.PDF_IMAGE_DPI), round(box_h / 72 * config.PDF_IMAGE_DPI)
+
+def _scale_to_box(source, box_px):
+    """Dekoduje grafikę i zmniejsza ją do ramki (bez powiększania). Zwraca bajty."""
+    with Image.open(source) as img:
+        img.thumbnail(box_px, Image.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        out = io.BytesIO()
+        if has_alpha:
+            img.save(out, "PNG", optimize=True)
+        else:
+            img.convert("RGB").save(out, "JPEG", quality=88)  # Dlaczego JPEG - patrz wariant "print" w obrazy.VARIANTS
+        return out.getvalue()
+
+def _cached_image(key, source, box_px):
+    with _image_cache_lock:
+        data = _image_cache.get(key)
+        if data is not None:
+            _image_cache.move_to_end(key)
+            _image_cache_stats["hits"] += 1
+            return ImageReader(io.BytesIO(data))
+        _image_cache_stats["misses"] += 1
+
+    data = _scale_to_box(source, box_px)
+    with _image_cache_lock:
+        _image_cache[key] = data
+        while len(_image_cache) > config.PDF_IMAGE_CACHE_SIZE:
+            _image_cache.popitem(last=False)
+    return ImageReader(io.BytesIO(data))
+
+def get_pdf_image(image_path, box_w, box_h):
+    """Grafika z dysku przeskalowana do ramki box_w x box_h (punkty PDF), z cache LRU."""
+    source = obrazy.variant_path(image_path, "print")
+    box_px = _box_pixels(box_w, box_h)
+    return _cached_image((source, os.path.getmtime(source), *box_px), source, box_px)
+
+def get_pdf_logo(logo_file, box_w, box_h):
+    """Logotyp (plik wgrany w formularzu) przeskalowany do ramki, z cache LRU (klucz - hash treści)."""
+    logo_file.seek(0)
+    data = logo_file.read()
+    box_px = _box_pixels(box_w, box_h)
+    return _cached_image(("logo", hashlib.sha1(data).hexdigest(), *box_px), io.BytesIO(data), box_px)
+
+def image_cache_stats():
+    """Liczniki trafień/chybień cache grafik PDF."""
+    with _image_cache_lock:
+        return {**_image_cache_stats, "entries": len(_image_cache)}
+
 def setup_fonts():
     """Konfiguruje czcionkę z obsługą polskich znaków."""
     global FONT_NAME
@@ -29,11 +97,10 @@ def draw_header(c, title, logo_file):
     """Nagłówek na 1. stronie (logo, tytuł, dane osobowe)."""
     if logo_file:
         try:
-            logo_file.seek(0)
-            logo_img = ImageReader(logo_file)
+            display_w = 2.5 * cm
+            logo_img = get_pdf_logo(logo_file, display_w, HEIGHT)
             img_w, img_h = logo_img.getSize()
             aspect = img_h / img_w
-            display_w = 2.5 * cm
             display_h = display_w * aspect
             c.drawImage(logo_img, WIDTH - MARGIN - display_w, HEIGHT - MARGIN - display_h + 0.5*cm, 
                         width=display_w, height=display_h, mask='auto')
@@ -51,9 +118,29 @@ def draw_footer(c, page_num, total_pages):
     text = f"Strona {page_num} z {total_pages}"
     c.drawRightString(WIDTH - MARGIN, MARGIN / 2, text)
 
-def generate_exam_content(c, questions, profession_name, logo_file, total_pages=None):
+class DeferredFooterCanvas(canvas.Canvas):
+    """
+    Canvas odkładający stopki 'Strona x z y' do chwili zapisu, gdy znana jest już
+    liczba stron - arkusz generowany jest w jednym przebiegu.
+    """
+    def __init__(self, *args, **kwargs):
+        canvas.Canvas.__init__(self, *args, **kwargs)
+        self._page_states = []
+
+    def showPage(self):
+        self._page_states.append(dict(self.__dict__))
+        self._startPage()
+
+    def save(self):
+        total_pages = len(self._page_states)
+        for state in self._page_states:
+            self.__dict__.update(state)
+            draw_footer(self, self._pageNumber, total_pages)
+            canvas.Canvas.showPage(self)
+        canvas.Canvas.save(self)
+
+def generate_exam_content(c, questions, profession_name, logo_file):
     """Główna logika z zawijaniem tekstu Paragraph."""
-    styles = getSampleStyleSheet()
     q_style = ParagraphStyle('Quest', fontName=FONT_NAME, fontSize=11, leading=13, spaceAfter=4)
     a_style = ParagraphStyle('Ans', fontName=FONT_NAME, fontSize=10, leading=12, leftIndent=0.5*cm)
     
@@ -72,9 +159,10 @@ def generate_exam_content(c, questions, profession_name, logo_file, total_pages=
             Paragraph(f"C) {html.escape(q.ans_c if q.ans_c else '')}", a_style)
         ]
 
-        # Obliczanie wysokości bloku
+        # Obliczanie wysokości bloku (wysokości zapamiętane i użyte ponownie przy rysowaniu)
         _, h_q = q_p.wrap(available_width, HEIGHT)
-        h_ans = sum([p.wrap(available_width, HEIGHT)[1] for p in ans_p])
+        ans_heights = [p.wrap(available_width, HEIGHT)[1] for p in ans_p]
+        h_ans = sum(ans_heights)
         
         needed = h_q + h_ans + 1.5 * cm
         if q.image_path: needed += 5 * cm
@@ -84,7 +172,6 @@ def generate_exam_content(c, questions, profession_name, logo_file, total_pages=
 
         # Nowa strona jeśli brak miejsca
         if y < needed:
-            if total_pages: draw_footer(c, c.getPageNumber(), total_pages)
             c.showPage()
             y = HEIGHT - MARGIN - 1 * cm
 
@@ -95,14 +182,15 @@ def generate_exam_content(c, questions, profession_name, logo_file, total_pages=
         # Obrazek główny pytania
         if q.image_path and os.path.exists(q.image_path):
             try:
-                c.drawImage(q.image_path, MARGIN + 1*cm, y - 4.5*cm, width=available_width-2*cm, height=4.5*cm, preserveAspectRatio=True, anchor='sw')
+                img = get_pdf_image(q.image_path, available_width-2*cm, 4.5*cm)
+                c.drawImage(img, MARGIN + 1*cm, y - 4.5*cm, width=available_width-2*cm, height=4.5*cm, preserveAspectRatio=True, anchor='sw')
                 y -= 5 * cm
             except: y -= 0.5 * cm
 
         # Rysowanie odpowiedzi
         img_fields = [q.image_a, q.image_b, q.image_c]
         for idx, p in enumerate(ans_p):
-            _, h = p.wrap(available_width, HEIGHT)
+            h = ans_heights[idx]
             p.drawOn(c, MARGIN, y - h)
             y -= h
             
@@ -111,28 +199,21 @@ def generate_exam_content(c, questions, profession_name, logo_file, total_pages=
             if img_path and os.path.exists(img_path):
                 try:
                     y -= 3.2 * cm
-                    c.drawImage(img_path, MARGIN + 1*cm, y, width=4*cm, height=3*cm, preserveAspectRatio=True, anchor='sw')
+                    img = get_pdf_image(img_path, 4*cm, 3*cm)
+                    c.drawImage(img, MARGIN + 1*cm, y, width=4*cm, height=3*cm, preserveAspectRatio=True, anchor='sw')
                     y -= 0.2 * cm
                 except: y -= 0.5 * cm
             y -= 0.2 * cm
         
         y -= 0.6 * cm # Odstęp między pytaniami
 
-    if total_pages: draw_footer(c, c.getPageNumber(), total_pages)
-
 def create_test_paper_pdf(questions, profession_name, logo_file=None):
     setup_fonts()
-    # Przebieg próbny do zliczenia stron
-    tmp = io.BytesIO()
-    c_tmp = canvas.Canvas(tmp, pagesize=A4)
-    generate_exam_content(c_tmp, questions, profession_name, logo_file, total_pages=None)
-    total_pages = c_tmp.getPageNumber()
-    c_tmp.save()
-
-    # Przebieg właściwy
+    # Jeden przebieg - stopki z liczbą stron dopisywane przy zapisie
     buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    generate_exam_content(c, questions, profession_name, logo_file, total_pages=total_pages)
+    c = DeferredFooterCanvas(buffer, pagesize=A4)
+    generate_exam_content(c, questions, profession_name, logo_file)
+    c.showPage()
     c.save()
     buffer.seek(0)
     return buffer
@@ -153,4 +234,75 @@ def create_answer_key_pdf(questions, profession_name):
             if col < 2: col += 1; y = HEIGHT - MARGIN - 3*cm
             else: c.showPage(); col = 0; y = HEIGHT - MARGIN - 3*cm
     c.save(); buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer
+
+# --- GENEROWANIE WIELU WARIANTÓW (pula procesów) ---
+
+# Lekka, serializowalna kopia pytania przekazywana do procesów roboczych
+PrintQuestion = namedtuple('PrintQuestion', [
+    'id', 'content', 'ans_a', 'ans_b', 'ans_c', 'correct_ans', 'image_path', 'image_a', 'image_b', 'image_c'
+])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Współdzielona pula procesów (spawn - bezpieczne obok wątków Streamlit)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config.PDF_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _render_variant(number, questions, profession_name, logo_bytes):
+    """Proces roboczy: arkusz i klucz odpowiedzi jednego wariantu."""
+    logo_file = io.BytesIO(logo_bytes) if logo_bytes else None
+    title = f"{profession_name} - wariant {number}"
+    paper = create_test_paper_pdf(questions, title, logo_file).getvalue()
+    key = create_answer_key_pdf(questions, title).getvalue()
+    return number, paper, key
+
+def create_variants_zip(variants, profession_name, logo_file=None, seed=None):
+    """
+    Renderuje warianty równolegle i zapisuje je do jednego archiwum ZIP
+    (arkusz + klucz na wariant oraz manifest.json z ID pytań każdego wariantu).
+    variants: lista list pytań (np. z manager.draw_exam_variants).
+    """
+    logo_bytes = None
+    if logo_file:
+        logo_file.seek(0)
+        logo_bytes = logo_file.read()
+
+    file_prefix = profession_name.replace(' ', '_')
+    manifest = {
+        "profession": profession_name,
+        "seed": seed,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "variants": [],
+    }
+    buffer = io.BytesIO()
+    pool = _get_pool()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        futures = []
+        for number, questions in enumerate(variants, start=1):
+            records = [PrintQuestion(*(getattr(q, f) for f in PrintQuestion._fields)) for q in questions]
+            futures.append(pool.submit(_render_variant, number, records, profession_name, logo_bytes))
+            manifest["variants"].append({
+                "variant": number,
+                "paper": f"Egzamin_{file_prefix}_{number:02d}.pdf",
+                "answer_key": f"Klucz_{file_prefix}_{number:02d}.pdf",
+                "question_ids": [q.id for q in questions],
+            })
+
+        # Pliki trafiają do archiwum w kolejności ukończenia, a PDF-y wariantu są zwalniane zaraz po dopisaniu.
+        # Samo archiwum (skompresowane) powstaje w pamięci - i tak trafia w całości do st.download_button.
+        for future in as_completed(futures):
+            number, paper, key = future.result()
+            entry = manifest["variants"][number - 1]
+            z.writestr(entry["paper"], paper)
+            z.writestr(entry["answer_key"], key)
+
+        z.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    buffer.seek(0)
+    return buffer
@@ -1,4 +1,6 @@
+import html
 import streamlit as st
+import obrazy
 FOOTER_TEXT = "By SQ9NIT and AJ, 2026. Stworzone z dużą ilością kawy"
 
 def apply_custom_css():
@@ -66,6 +68,28 @@ def apply_custom_css():
     """
     st.markdown(pastel_css, unsafe_allow_html=True)
 
+def st_image(image_path, variant, caption=None, width=None):
+    """
+    Wyświetla wariant grafiki. Przy włączonym serwerze grafik (MEDIA_BASE_URL) wstawia
+    znacznik <img> z wersjonowanym adresem - przeglądarka pobiera plik raz i trzyma go w cache.
+    Bez serwera - st.image (plik przesyłany przez Streamlit przy każdym przebiegu).
+    width: szerokość w px; domyślnie cała szerokość kolumny.
+    """
+    url = obrazy.image_url(image_path, variant)
+    if url is None:
+        path = obrazy.variant_path(image_path, variant)
+        if width:
+            st.image(path, caption=caption, width=width)
+        else:
+            st.image(path, caption=caption, use_container_width=True)
+        return
+
+    size = f"width:{width}px" if width else "width:100%"
+    img = f'<img src="{html.escape(url)}" style="{size};height:auto" loading="lazy" decoding="async" alt="">'
+    if caption:
+        img = f'<figure style="margin:0">{img}<figcaption style="text-align:center;font-size:0.85rem;color:#6c757d">{html.escape(caption)}</figcaption></figure>'
+    st.markdown(img, unsafe_allow_html=True)
+
 def st_responsive_image(image_path, caption=None, width_percent=0.6):
     """
     Wyświetla obrazek responsywnie:
@@ -76,7 +100,7 @@ def st_responsive_image(image_path, caption=None, width_percent=0.6):
         side_space = (1.0 - width_percent) / 2
         col1, col2, col3 = st.columns([side_space, width_percent, side_space])
         with col2:
-            st.image(image_path, caption=caption, use_container_width=True)
+            st_image(image_path, "display", caption=caption)
 
 def st_answer_layout(label, text, img_path=None):
     """Układ dla odpowiedzi A, B, C: Tekst obok obrazka."""
@@ -85,7 +109,7 @@ def st_answer_layout(label, text, img_path=None):
         st.markdown(f"#### {label}) {text if text else ''}")
     with col_img:
         if img_path:
-            st.image(img_path, use_container_width=True)
+            st_image(img_path, "display")
     st.divider()
 
 def draw_footer():
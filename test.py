@@ -1,179 +1,334 @@
 import streamlit as st
-import random
+from streamlit.errors import StreamlitAPIException
 import os
-from db import get_session, Question, ProfessionGroup, TestType, update_question_stats
+from array import array
+from datetime import datetime
+from db import get_professions, get_test_types, save_exam_attempt, get_exam_questions, query_scope
 import config
 import style  # <--- NASZ NOWY MODUŁ STYLÓW
+import exam_client
+import exam_progress
+import manager
+
+TEST_STATE_PREFIXES = ('test_', 'user_answers', 'current_idx', 'results_calculated', 'score', 'q_', 'rev_',
+                       'exam_client_')
 
 def init_test_state():
-    """Inicjalizacja zmiennych sesyjnych dla testu."""
+    """Inicjalizacja zmiennych sesyjnych dla testu (egzamin innego użytkownika jest porzucany)."""
+    if st.session_state.get('test_owner_id') != st.session_state.user.id:
+        for key in [k for k in st.session_state.keys() if k.startswith(TEST_STATE_PREFIXES)]:
+            del st.session_state[key]
+        st.session_state.test_owner_id = st.session_state.user.id
     if 'test_questions' not in st.session_state:
-        st.session_state.test_questions = []
+        st.session_state.test_questions = {}  # ID -> współdzielona migawka ExamQuestion
+        st.session_state.test_order = array('l')  # kolejność pytań w egzaminie (ID)
         st.session_state.user_answers = {}
         st.session_state.current_idx = 0
         st.session_state.test_phase = 'setup'
         st.session_state.results_calculated = False
+        st.session_state.test_progress_seq = 0  # Numer ostatniego zapisu postępu (exam_progress)
+        st.session_state.test_progress_saved = None
 
 def draw_questions(profession_id, test_type_id):
-    """Logika losowania 30 pytań."""
-    session = get_session()
-    query = session.query(Question).join(Question.professions).join(Question.test_types)
-    query = query.filter(ProfessionGroup.id == profession_id)
-    query = query.filter(TestType.id == test_type_id)
-    pool = query.all()
-    session.close()
-
-    if not pool:
-        return []
-
-    if len(pool) >= 30:
-        return random.sample(pool, 30)
-    else:
-        return random.choices(pool, k=30)
+    """Logika losowania 30 pytań. Zwraca (kolejność ID, słownik migawek)."""
+    ids = manager.draw_exam_ids(profession_id, test_type_id)
+    if not ids:
+        return array('l'), {}
+    # Pełne dane pobieramy tylko dla wylosowanych pytań
+    questions = get_exam_questions(ids)
+    # Pytanie usunięte w międzyczasie wypada z kolejności
+    return array('l', (q_id for q_id in ids if q_id in questions)), questions
+
+def exam_question(idx):
+    """Migawka pytania na pozycji idx bieżącego egzaminu."""
+    return st.session_state.test_questions[st.session_state.test_order[idx]]
+
+def exam_total():
+    """Liczba pytań bieżącego egzaminu - mniej niż 30, gdy pytania usunięto z bazy w międzyczasie."""
+    return len(st.session_state.test_order)
+
+def exam_questions():
+    """Migawki pytań egzaminu w kolejności (powtórzenia są tym samym obiektem)."""
+    return [st.session_state.test_questions[q_id] for q_id in st.session_state.test_order]
+
+def progress_snapshot():
+    """Bieżący postęp egzaminu z sesji w postaci do zapisu w magazynie."""
+    order = st.session_state.test_order
+    return exam_progress.Progress(
+        user_id=st.session_state.user.id,
+        seq=st.session_state.test_progress_seq,
+        profession_id=st.session_state.get('test_profession_id'),
+        test_type_id=st.session_state.get('test_type_id'),
+        question_ids=list(order),
+        answers=[st.session_state.user_answers.get(i) for i in range(len(order))],
+        current_idx=st.session_state.current_idx,
+        phase=st.session_state.test_phase,
+        started_at=st.session_state.get('test_started_at'),
+        updated_at=datetime.now()
+    )
+
+def _progress_state():
+    return (tuple(sorted(st.session_state.user_answers.items())), st.session_state.current_idx,
+            st.session_state.test_phase)
+
+def persist_progress():
+    """Zgłasza postęp do zapisu (scalanego w tle), jeśli zmienił się od ostatniego przebiegu."""
+    state = _progress_state()
+    if state == st.session_state.test_progress_saved:
+        return
+    st.session_state.test_progress_saved = state
+    st.session_state.test_progress_seq += 1
+    exam_progress.save(progress_snapshot())
+
+def resume_test(progress):
+    """Odtwarza stan sesji z zapisanego postępu. Zwraca False, gdy z egzaminu nic nie zostało."""
+    questions = get_exam_questions(progress.question_ids)
+    # Pytania usunięte w międzyczasie wypadają razem z odpowiedziami na ich pozycjach
+    kept = [(q_id, ans) for q_id, ans in zip(progress.question_ids, progress.answers) if q_id in questions]
+    if not kept:
+        return False
+    st.session_state.test_order = array('l', (q_id for q_id, _ in kept))
+    st.session_state.test_questions = questions
+    st.session_state.user_answers = {i: ans for i, (_, ans) in enumerate(kept) if ans is not None}
+    st.session_state.current_idx = min(progress.current_idx, len(kept) - 1)
+    st.session_state.test_profession_id = progress.profession_id
+    st.session_state.test_type_id = progress.test_type_id
+    st.session_state.test_started_at = progress.started_at
+    st.session_state.test_progress_seq = progress.seq
+    st.session_state.test_phase = progress.phase
+    return True
 
 def finish_test():
     """Obliczanie wyników i aktualizacja bazy."""
     correct_count = 0
-    for i, q in enumerate(st.session_state.test_questions):
+    answers = []
+    for i, q in enumerate(exam_questions()):
         user_ans = st.session_state.user_answers.get(i)
         is_correct = (user_ans == q.correct_ans)
         if is_correct:
             correct_count += 1
-        update_question_stats(q.id, is_correct)
+        answers.append((q.id, user_ans, is_correct))
+
+    # Jedna transakcja: historia podejścia + statystyki pytań
+    save_exam_attempt(
+        st.session_state.user.id,
+        st.session_state.get('test_profession_id'),
+        st.session_state.get('test_type_id'),
+        answers,
+        started_at=st.session_state.get('test_started_at')
+    )
     
+    exam_progress.clear(st.session_state.user.id)
     st.session_state.score = correct_count
     st.session_state.test_phase = 'finished'
 
+def rerun_exam_card():
+    """Ponowne narysowanie karty egzaminu - samego fragmentu, a w pełnym przebiegu całej strony."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # Zakres 'fragment' jest dozwolony tylko podczas przebiegu fragmentu
+        st.rerun()
+
+@st.fragment
+def show_exam_fragment():
+    """
+    Karta pytania, odpowiedź i nawigacja jako fragment: kliknięcie przelicza tylko tę część
+    strony (bez paska bocznego, CSS, routingu i stopki). Pełny przebieg tylko przy zakończeniu testu.
+    """
+    with query_scope("📝 Rozwiąż Test (fragment)"):
+        if st.session_state.test_phase == 'testing':
+            show_testing()
+        elif st.session_state.test_phase == 'review':
+            show_review()
+        persist_progress()
+
+def show_testing():
+    """FAZA 2: TESTOWANIE - bieżące pytanie, wybór odpowiedzi i nawigacja."""
+    idx = st.session_state.current_idx
+    q = exam_question(idx)
+    total = exam_total()
+
+    st.subheader(f"Pytanie {idx + 1} z {total}")
+
+    # Treść pytania
+    st.write(f"### {q.content}")
+
+    # Główna grafika pytania (Responsywna 60% PC / 100% Mobile)
+    if q.image_path:
+        style.st_responsive_image(q.image_path)
+
+    st.divider()
+
+    # Układ odpowiedzi z grafikami (Tekst obok obrazka)
+    options = {
+        "A": (q.ans_a, q.image_a),
+        "B": (q.ans_b, q.image_b),
+        "C": (q.ans_c, q.image_c)
+    }
+
+    # Wyświetlamy wizualny podgląd odpowiedzi (z obrazkami)
+    for label in ["A", "B", "C"]:
+        text, img = options[label]
+        style.st_answer_layout(label, text, img)
+
+    # Wybór odpowiedzi (Radio)
+    current_choice = st.session_state.user_answers.get(idx)
+    choice = st.radio(
+        "Twoja decyzja:", 
+        ["A", "B", "C"], 
+        index=None if current_choice is None else ["A", "B", "C"].index(current_choice),
+        horizontal=True,
+        key=f"q_{idx}"
+    )
+
+    # Nawigacja
+    col1, col2 = st.columns(2)
+    if col1.button("Zatwierdź i dalej", disabled=(choice is None), type="primary", use_container_width=True):
+        st.session_state.user_answers[idx] = choice
+        next_idx = next((i for i in range(total) if i not in st.session_state.user_answers), None)
+        if next_idx is not None:
+            st.session_state.current_idx = next_idx
+        rerun_exam_card()
+
+    if col2.button("Pomiń / Poprzednie", use_container_width=True):
+        st.session_state.current_idx = (idx + 1) % total
+        rerun_exam_card()
+
+    # Stopka testu
+    if len(st.session_state.user_answers) == total:
+        st.success("Wszystkie odpowiedzi udzielone!")
+        c1, c2 = st.columns(2)
+        if c1.button("ZAKOŃCZ I OCEŃ", type="primary", use_container_width=True):
+            finish_test()
+            st.rerun()  # Wyniki są poza fragmentem - pełny przebieg
+        if c2.button("Przejrzyj wszystko", use_container_width=True):
+            st.session_state.test_phase = 'review'
+            st.session_state.current_idx = 0
+            rerun_exam_card()
+
+def show_review():
+    """FAZA 3: PRZEGLĄD - korekta udzielonych odpowiedzi przed oceną."""
+    idx = st.session_state.current_idx
+    q = exam_question(idx)
+    total = exam_total()
+    st.subheader(f"Przegląd pytań - {idx + 1}/{total}")
+
+    # Powtarzamy układ responsywny
+    st.write(f"**{q.content}**")
+    if q.image_path:
+        style.st_responsive_image(q.image_path)
+
+    current_val = st.session_state.user_answers.get(idx)
+    new_choice = st.radio("Zmień odpowiedź:", ["A", "B", "C"], 
+                          index=["A", "B", "C"].index(current_val) if current_val else None,
+                          key=f"rev_{idx}")
+
+    if st.button("Zapisz korektę", use_container_width=True):
+        st.session_state.user_answers[idx] = new_choice
+        st.toast("Zmiana zapisana!")
+
+    c1, c2, c3 = st.columns(3)
+    if c1.button("Wstecz", use_container_width=True) and idx > 0:
+        st.session_state.current_idx -= 1
+        rerun_exam_card()
+    if c2.button("Dalej", use_container_width=True) and idx < total - 1:
+        st.session_state.current_idx += 1
+        rerun_exam_card()
+    if c3.button("ZAKOŃCZ", type="primary", use_container_width=True):
+        finish_test()
+        st.rerun()
+
+def show_client_exam():
+    """
+    FAZA 2 i 3 w trybie przeglądarkowym: cały egzamin w komponencie exam_client,
+    serwer wykonuje pełny przebieg dopiero po odesłaniu kompletu odpowiedzi i ocenia je sam.
+    """
+    questions = exam_questions()
+    exam_id = f"{st.session_state.user.id}-{st.session_state.test_started_at.isoformat()}"
+    result = exam_client.exam_client(exam_id, questions, key=f"exam_client_{exam_id}")
+    answers = exam_client.parse_answers(result, len(questions))
+    if answers is not None:
+        st.session_state.user_answers = answers
+        finish_test()
+        st.rerun()
+
+def show_resume_offer():
+    """Propozycja wznowienia niedokończonego egzaminu (np. po zerwanym połączeniu lub restarcie)."""
+    user_id = st.session_state.user.id
+    if 'test_resume' not in st.session_state:
+        st.session_state.test_resume = exam_progress.load(user_id)
+    progress = st.session_state.test_resume
+    if not progress:
+        return
+
+    answered = sum(1 for a in progress.answers if a is not None)
+    st.info(f"Masz niedokończony egzamin rozpoczęty {progress.started_at:%d.%m.%Y %H:%M} "
+            f"({answered}/{len(progress.question_ids)} odpowiedzi).")
+    c1, c2 = st.columns(2)
+    if c1.button("WZNÓW EGZAMIN", type="primary", use_container_width=True):
+        st.session_state.test_resume = None
+        if resume_test(progress):
+            st.session_state.test_progress_saved = _progress_state()
+            st.rerun()
+        exam_progress.clear(user_id)
+        st.error("Pytania z przerwanego egzaminu zostały usunięte z bazy - rozpocznij nowy test.")
+    if c2.button("Porzuć i zacznij nowy", use_container_width=True):
+        exam_progress.clear(user_id)
+        st.session_state.test_resume = None
+        st.rerun()
+    st.divider()
+
 def show_test_ui():
-    # 1. Aplikujemy pastelowe style na starcie
-    style.apply_custom_css()
+    # Style CSS wstrzykuje app.py raz na pełny przebieg - fragmenty egzaminu ich nie powtarzają
     init_test_state()
 
     # --- FAZA 1: SETUP ---
     if st.session_state.test_phase == 'setup':
         st.title("📝 Nowy Egzamin")
-        session = get_session()
-        profs = session.query(ProfessionGroup).all()
+        show_resume_offer()
+        profs = get_professions()
         user_profs = st.session_state.user.professions if st.session_state.user.role == config.ROLE_USER else profs
         
         prof_opt = {p.name: p.id for p in user_profs}
-        type_opt = {t.name: t.id for t in session.query(TestType).all()}
-        session.close()
+        type_opt = {t.name: t.id for t in get_test_types()}
 
         sel_prof = st.selectbox("Wybierz grupę zawodową", list(prof_opt.keys()))
         sel_type = st.selectbox("Wybierz rodzaj testu", list(type_opt.keys()))
 
         if st.button("ROZPOCZNIJ TEST", type="primary", use_container_width=True):
-            questions = draw_questions(prof_opt[sel_prof], type_opt[sel_type])
-            if questions:
+            order, questions = draw_questions(prof_opt[sel_prof], type_opt[sel_type])
+            if order:
+                st.session_state.test_order = order
                 st.session_state.test_questions = questions
+                st.session_state.test_profession_id = prof_opt[sel_prof]
+                st.session_state.test_type_id = type_opt[sel_type]
+                # Bez mikrosekund - MariaDB ich nie przechowuje, a started_at identyfikuje egzamin w magazynie postępu
+                st.session_state.test_started_at = datetime.now().replace(microsecond=0)
                 st.session_state.test_phase = 'testing'
+                exam_progress.save(progress_snapshot(), immediate=True)
+                st.session_state.test_progress_saved = _progress_state()
+                st.session_state.test_resume = None
                 st.rerun()
             else:
                 st.error("Brak pytań dla wybranej konfiguracji.")
 
-    # --- FAZA 2: TESTOWANIE ---
-    elif st.session_state.test_phase == 'testing':
-        idx = st.session_state.current_idx
-        q = st.session_state.test_questions[idx]
-
-        st.subheader(f"Pytanie {idx + 1} z 30")
-        
-        # Treść pytania
-        st.write(f"### {q.content}")
-
-        # Główna grafika pytania (Responsywna 60% PC / 100% Mobile)
-        if q.image_path:
-            style.st_responsive_image(q.image_path)
-        
-        st.divider()
-
-        # Układ odpowiedzi z grafikami (Tekst obok obrazka)
-        options = {
-            "A": (q.ans_a, q.image_a),
-            "B": (q.ans_b, q.image_b),
-            "C": (q.ans_c, q.image_c)
-        }
-
-        # Wyświetlamy wizualny podgląd odpowiedzi (z obrazkami)
-        for label in ["A", "B", "C"]:
-            text, img = options[label]
-            style.st_answer_layout(label, text, img)
-
-        # Wybór odpowiedzi (Radio)
-        current_choice = st.session_state.user_answers.get(idx)
-        choice = st.radio(
-            "Twoja decyzja:", 
-            ["A", "B", "C"], 
-            index=None if current_choice is None else ["A", "B", "C"].index(current_choice),
-            horizontal=True,
-            key=f"q_{idx}"
-        )
-
-        # Nawigacja
-        col1, col2 = st.columns(2)
-        if col1.button("Zatwierdź i dalej", disabled=(choice is None), type="primary", use_container_width=True):
-            st.session_state.user_answers[idx] = choice
-            next_idx = next((i for i in range(30) if i not in st.session_state.user_answers), None)
-            if next_idx is not None:
-                st.session_state.current_idx = next_idx
-            st.rerun()
-
-        if col2.button("Pomiń / Poprzednie", use_container_width=True):
-            st.session_state.current_idx = (idx + 1) % 30
-            st.rerun()
-
-        # Stopka testu
-        if len(st.session_state.user_answers) == 30:
-            st.success("Wszystkie odpowiedzi udzielone!")
-            c1, c2 = st.columns(2)
-            if c1.button("ZAKOŃCZ I OCEŃ", type="primary", use_container_width=True):
-                finish_test()
-                st.rerun()
-            if c2.button("Przejrzyj wszystko", use_container_width=True):
-                st.session_state.test_phase = 'review'
-                st.session_state.current_idx = 0
-                st.rerun()
-
-    # --- FAZA 3: PRZEGLĄD ---
-    elif st.session_state.test_phase == 'review':
-        idx = st.session_state.current_idx
-        q = st.session_state.test_questions[idx]
-        st.subheader(f"Przegląd pytań - {idx + 1}/30")
-        
-        # Powtarzamy układ responsywny
-        st.write(f"**{q.content}**")
-        if q.image_path:
-            style.st_responsive_image(q.image_path)
-
-        current_val = st.session_state.user_answers.get(idx)
-        new_choice = st.radio("Zmień odpowiedź:", ["A", "B", "C"], 
-                              index=["A", "B", "C"].index(current_val) if current_val else None,
-                              key=f"rev_{idx}")
-        
-        if st.button("Zapisz korektę", use_container_width=True):
-            st.session_state.user_answers[idx] = new_choice
-            st.toast("Zmiana zapisana!")
-
-        c1, c2, c3 = st.columns(3)
-        if c1.button("Wstecz", use_container_width=True) and idx > 0:
-            st.session_state.current_idx -= 1
-            st.rerun()
-        if c2.button("Dalej", use_container_width=True) and idx < 29:
-            st.session_state.current_idx += 1
-            st.rerun()
-        if c3.button("ZAKOŃCZ", type="primary", use_container_width=True):
-            finish_test()
-            st.rerun()
+    # --- FAZA 2 i 3: TESTOWANIE / PRZEGLĄD (fragment - bez przebiegu całej aplikacji) ---
+    elif st.session_state.test_phase in ('testing', 'review'):
+        if config.EXAM_CLIENT_MODE:
+            show_client_exam()
+        else:
+            show_exam_fragment()
 
     # --- FAZA 4: WYNIKI ---
     elif st.session_state.test_phase == 'finished':
         st.title("📊 Wynik Twojego Egzaminu")
         score = st.session_state.score
-        percent = round((score / 30) * 100, 2)
+        total = exam_total()
+        percent = round((score / total) * 100, 2)
         
         # Metric w pastelowym stylu
-        st.metric("Skuteczność", f"{percent}%", f"{score} / 30")
+        st.metric("Skuteczność", f"{percent}%", f"{score} / {total}")
         
         if percent >= 90:
             st.balloons()
@@ -182,7 +337,7 @@ def show_test_ui():
             st.error("Niestety, wynik poniżej progu zaliczeniowego (90%).")
 
         st.subheader("Analiza błędów:")
-        for i, q in enumerate(st.session_state.test_questions):
+        for i, q in enumerate(exam_questions()):
             user_ans = st.session_state.user_answers.get(i)
             if user_ans != q.correct_ans:
                 with st.expander(f"❌ Pytanie nr {i+1}: {q.content[:50]}..."):